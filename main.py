@@ -18,16 +18,23 @@ warnings.filterwarnings("ignore")
 
 import gc
 import re
+import pickle
 import os
+import hashlib
 import joblib
+from joblib import Parallel, delayed
 import json
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import ephem
 import holidays
 from functools import lru_cache
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from itertools import combinations
 from pathlib import Path
 from io import StringIO
 from sklearn.metrics import (
@@ -37,6 +44,10 @@ from sklearn.metrics import (
 from sklearn.model_selection import StratifiedGroupKFold
 from catboost import CatBoostClassifier, Pool
 
+# Copy-on-write: производные DataFrame/Series делят память с исходными до первой записи,
+# поэтому «защитные» копии функций обогащения ничего не стоят
+pd.set_option('mode.copy_on_write', True)
+
 # Опциональные библиотеки для расширенного функционала
 try:
     from meteostat import Point, Daily
@@ -54,6 +65,16 @@ except Exception:
     TIMEZONEFINDER_AVAILABLE = False
     print("[WARN] Библиотека 'timezonefinder' не установлена. Будет использован резервный словарь таймзон.")
 
+try:
+    from numba import njit
+except ImportError:
+    # Без numba декоратор — тождественный, путь на чистом Python сообщается один раз предупреждением ниже
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+    print("[WARN] Библиотека 'numba' не установлена. Астро-расчеты будут выполняться без JIT-компиляции. Установите: pip install numba")
+
 try:
     import psutil
     # Ограничиваем использование RAM (60% от доступной), чтобы избежать сбоев на больших данных
@@ -77,14 +98,25 @@ SOURCE_DATA_PATH = DATA_DIR / "your_source_dataset.csv"
 EVENTS_TSV_PATH = DATA_DIR / "events.tsv"
 KP_INDEX_PATH = DATA_DIR / "kp_index.json"
 AP_INDEX_PATH = DATA_DIR / "ap_index.json"
+# Типы известных колонок исходного CSV: низкокардинальные строки сразу читаются как category, 'ww' — как текст
+# (его очистка от запятых/мусора выполняется в enrich_data_full); отсутствующие в файле колонки игнорируются
+SOURCE_CSV_DTYPES = {'region': 'category', 'nps_segment': 'category', 'ww': str}
 
 # Выходные файлы
-ENRICHED_DATA_SAVE_PATH = BASE_DIR / "enriched_nps_data.csv.gz"
-MODEL_SAVE_PATH = BASE_DIR / 'catboost_detractor_model.joblib'
+ENRICHED_DATA_SAVE_PATH = BASE_DIR / "enriched_nps_data.parquet"
+ENRICHED_SAVE_CSV = False  # True = старый формат csv.gz (медленнее и крупнее, но читается без pyarrow)
+MODEL_SAVE_PATH = BASE_DIR / 'catboost_detractor_model.cbm'  # нативный формат CatBoost: CatBoostClassifier().load_model(path)
+# Версия дисковых кэшей: увеличьте при изменении логики астро/погоды/праздников, чтобы старые файлы не читались
+CACHE_VERSION = "v1"
+ASTRO_CACHE_PATH = CACHE_DIR / f"astro_cache_{CACHE_VERSION}.parquet"
+HOLIDAYS_CACHE_PATH = CACHE_DIR / f"ru_holidays_{CACHE_VERSION}.pkl"
 
 # --- Параметры моделирования и обогащения ---
 RANDOM_SEED = 42
 N_SPLITS_CV = 8
+ASTRO_N_JOBS = -1          # Процессы для астро-расчетов (-1 = все ядра, 1 = без параллелизма)
+ASTRO_CHUNK_SIZE = 256     # Число дат одной таймзоны в одной задаче
+METEOSTAT_MAX_WORKERS = 8  # Потоки для параллельной загрузки станций Meteostat
 
 # --- Константы для астрологических расчетов ---
 ASTRO_TENSION_WINDOW = [5]
@@ -231,116 +263,298 @@ REGION_COORDS_MASTER = {
     'Республика Саха (Якутия)': [(62.0282, 129.7331), (67.450, 133.383), (70.633, 118.267), (59.367, 112.567), (71.626, 128.869), (63.033, 118.300), (64.567, 143.217), (56.650, 124.700), (69.410, 147.92)],
 }
 
-def region_to_tz(region_name: str) -> str:
+def _build_coords_soa(coords_master: dict):
+    """Раскладывает словарь координат в плоские массивы широт/долгот и индекс region -> (start, stop)."""
+    lats = np.fromiter((lat for pts in coords_master.values() for lat, _ in pts), dtype=np.float64)
+    lons = np.fromiter((lon for pts in coords_master.values() for _, lon in pts), dtype=np.float64)
+    slices, i = {}, 0
+    for region, pts in coords_master.items():
+        slices[region] = (i, i + len(pts))
+        i += len(pts)
+    return lats, lons, slices
+
+COORDS_LAT, COORDS_LON, REGION_SLICE = _build_coords_soa(REGION_COORDS_MASTER)
+
+def region_coords(region_name: str):
+    """Координаты точек региона как пара массивов (lats, lons); пустые массивы, если регион неизвестен."""
+    start, stop = REGION_SLICE.get(region_name, (0, 0))
+    return COORDS_LAT[start:stop], COORDS_LON[start:stop]
+
+def _resolve_region_tz(region_name: str) -> str:
     """Определяет таймзону по названию региона, используя timezonefinder или резервный словарь."""
     if TIMEZONEFINDER_AVAILABLE and TF is not None:
-        coords_list = REGION_COORDS_MASTER.get(region_name)
-        if coords_list:
-            lat, lon = coords_list[0]
-            tz = TF.timezone_at(lat=lat, lon=lon)
+        lats, lons = region_coords(region_name)
+        if len(lats):
+            try:
+                tz = TF.timezone_at(lat=float(lats[0]), lng=float(lons[0]))
+            except Exception:
+                tz = None
             if tz:
                 return tz
     # Резервный вариант, если timezonefinder не сработал
     return RU_TZ_BY_REGION.get(region_name, 'Europe/Moscow')
 
+# Регионов немного, поэтому таймзоны определяются один раз при импорте
+REGION_TZ_RESOLVED = {region: _resolve_region_tz(region) for region in {*REGION_COORDS_MASTER, *RU_TZ_BY_REGION}}
+
+def region_to_tz(region_name: str) -> str:
+    """Таймзона региона из предрасчитанного словаря REGION_TZ_RESOLVED."""
+    return REGION_TZ_RESOLVED.get(region_name, 'Europe/Moscow')
+
 
 # ============================================================
 # ==== БЛОК 1: АСТРОЛОГИЯ ====
 # ============================================================
-@lru_cache(maxsize=10000)
-def get_planet_details(planet_name, ephem_date):
-    planet_map = {'Sun': ephem.Sun, 'Moon': ephem.Moon, 'Mercury': ephem.Mercury, 'Venus': ephem.Venus, 'Mars': ephem.Mars, 'Jupiter': ephem.Jupiter, 'Saturn': ephem.Saturn, 'Uranus': ephem.Uranus, 'Neptune': ephem.Neptune, 'Pluto': ephem.Pluto}
-    planet_obj = planet_map[planet_name](); planet_obj.compute(ephem_date)
-    ecl = ephem.Ecliptic(planet_obj); lon = ecl.lon
-    speed = 0.0
-    if planet_name not in ['Sun', 'Moon']:
-        planet_obj.compute(ephem_date - 0.5); lon1 = ephem.Ecliptic(planet_obj).lon
-        planet_obj.compute(ephem_date + 0.5); lon2 = ephem.Ecliptic(planet_obj).lon
-        speed = np.degrees(lon2 - lon1)
-        if speed > 180: speed -= 360
-        elif speed < -180: speed += 360
-    signs = ['Овен','Телец','Близнецы','Рак','Лев','Дева','Весы','Скорпион','Стрелец','Козерог','Водолей','Рыбы']
-    sign_name = signs[int(np.degrees(lon) // 30)]
-    return {'speed': float(speed), 'sign': sign_name, 'lon': lon}
-
-@lru_cache(maxsize=50000)
-def get_astro_cats_only(date: pd.Timestamp, tz: str):
-    local_noon_utc = date.replace(hour=12).tz_localize(tz).tz_convert('UTC')
-    d = ephem.Date(local_noon_utc.to_pydatetime()); d_prev = ephem.Date(d - 1)
-    moon_details = get_planet_details('Moon', d)
-    moon = ephem.Moon(d); pct = float(moon.phase)
-    prev_new_moon, next_new_moon = ephem.previous_new_moon(d), ephem.next_new_moon(d)
-    age = d - prev_new_moon
-    lunar_day_num = int(np.floor(age)) + 1
-    def moon_phase_name_from_pct(p):
-        if p < 5 or p > 95: return 'Новолуние'
-        if p < 45: return 'Растущая'
-        if p < 55: return 'Полнолуние'
-        return 'Убывающая'
-    def bin_lunar_day(n):
-        if n <= 7: return '1-7'
-        if n <= 14: return '8-14'
-        if n <= 21: return '15-21'
-        return '22-30'
-    moon_phase_cat = moon_phase_name_from_pct(pct)
-    lunar_day_cat = bin_lunar_day(lunar_day_num)
-    is_hecate = 1 if (next_new_moon - d) < 2.5 else 0
-    moon_lon_in_sign = np.degrees(moon_details['lon']) % 30
-    is_moon_voc_proxy = 1 if moon_lon_in_sign > 27 else 0
-    sun_details = get_planet_details('Sun', d); sun_sign_cat = sun_details['sign']
-    solar_eclipses_utc = pd.to_datetime(['2022-10-25','2023-04-20','2024-04-08','2024-10-02'], utc=True)
-    lunar_eclipses_utc = pd.to_datetime(['2022-05-16','2022-11-08','2023-05-05','2023-10-28','2024-03-25','2024-09-18'], utc=True)
+PLANET_CLASSES = {'Sun': ephem.Sun, 'Moon': ephem.Moon, 'Mercury': ephem.Mercury, 'Venus': ephem.Venus, 'Mars': ephem.Mars, 'Jupiter': ephem.Jupiter, 'Saturn': ephem.Saturn, 'Uranus': ephem.Uranus, 'Neptune': ephem.Neptune, 'Pluto': ephem.Pluto}
+SIGNS = ['Овен','Телец','Близнецы','Рак','Лев','Дева','Весы','Скорпион','Стрелец','Козерог','Водолей','Рыбы']
+
+PLANET_INSTANCES = {name: cls() for name, cls in PLANET_CLASSES.items()}
+
+@njit(cache=True)
+def _planet_speed_and_sign(lon_prev, lon_next, lon_today):
+    """Суточная скорость (с учетом перехода через 0°) и индекс знака по массивам долгот в градусах."""
+    n = lon_today.shape[0]
+    speed = np.empty(n, dtype=np.float64)
+    sign_idx = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        s = lon_next[i] - lon_prev[i]
+        if s > 180.0: s -= 360.0
+        elif s < -180.0: s += 360.0
+        speed[i] = s
+        sign_idx[i] = int(lon_today[i] // 30) % 12
+    return speed, sign_idx
+
+def get_ecliptic_lons(planet_name, ephem_dates) -> np.ndarray:
+    """Эклиптические долготы планеты (в градусах) для массива дат ephem."""
+    planet_obj = PLANET_INSTANCES[planet_name]
+    lons = np.empty(len(ephem_dates), dtype=np.float64)
+    for i, d in enumerate(ephem_dates):
+        planet_obj.compute(d)
+        lons[i] = ephem.Ecliptic(planet_obj).lon
+    return np.degrees(lons)
+
+ASPECT_BODIES = [PLANET_INSTANCES[p] for p in ASPECT_PLANETS]
+
+def compute_aspect_lons(ephem_dates):
+    """
+    Матрица долгот ASPECT_PLANETS (градусы, форма (n_dates, len(ASPECT_PLANETS))) и фаза Луны (%).
+    Все тела считаются за один проход по датам, фаза берется из того же расчета Луны.
+    """
+    lons = np.empty((len(ephem_dates), len(ASPECT_BODIES)), dtype=np.float64)
+    phase = np.empty(len(ephem_dates), dtype=np.float64)
+    moon = PLANET_INSTANCES['Moon']
+    for i, d in enumerate(ephem_dates):
+        for j, body in enumerate(ASPECT_BODIES):
+            body.compute(d)
+            lons[i, j] = ephem.Ecliptic(body).lon
+        phase[i] = moon.phase
+    return np.degrees(lons), phase
+
+PLANET_BLOCK_OFFSETS = np.array([-1.5, -1.0, -0.5, 0.0, 0.5])
+
+def compute_planet_block(planet_name, ephem_dates):
+    """
+    Скорость и знак планеты на каждую дату и на предыдущие сутки: (speed, speed_prev, sign_idx, sign_prev_idx).
+    Моменты d-1.5 ... d+0.5 всех дат считаются одним проходом, совпадающие у соседних дней — один раз.
+    """
+    d = np.asarray(ephem_dates, dtype=np.float64)
+    points, inverse = np.unique(d[:, None] + PLANET_BLOCK_OFFSETS[None, :], return_inverse=True)
+    lons = get_ecliptic_lons(planet_name, points)[inverse.reshape(len(d), len(PLANET_BLOCK_OFFSETS))]
+    speed, sign_idx = _planet_speed_and_sign(lons[:, 2], lons[:, 4], lons[:, 3])
+    speed_prev, sign_prev_idx = _planet_speed_and_sign(lons[:, 0], lons[:, 2], lons[:, 1])
+    return speed, speed_prev, sign_idx, sign_prev_idx
+
+ECLIPSE_WINDOW_DAYS = 3
+
+NS_PER_DAY = 86_400 * 10**9
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+SOLAR_ECL_DATES = (date(2022, 10, 25), date(2023, 4, 20), date(2024, 4, 8), date(2024, 10, 2))
+LUNAR_ECL_DATES = (date(2022, 5, 16), date(2022, 11, 8), date(2023, 5, 5), date(2023, 10, 28), date(2024, 3, 25), date(2024, 9, 18))
+
+def _eclipse_local_days(ecl_dates: tuple, tz: str) -> np.ndarray:
+    """Отсортированные номера локальных дней (int64, дни от эпохи) затмений (полночь UTC) для таймзоны tz."""
     try:
-        solar_dates = set(solar_eclipses_utc.tz_convert(tz).date)
-        lunar_dates = set(lunar_eclipses_utc.tz_convert(tz).date)
+        zone = ZoneInfo(tz)
+        local = [datetime(d.year, d.month, d.day, tzinfo=timezone.utc).astimezone(zone).date() for d in ecl_dates]
     except Exception:
-        solar_dates = set(solar_eclipses_utc.date)
-        lunar_dates = set(lunar_eclipses_utc.date)
-    local_date = date.date()
-    is_solar_in_window = any(abs((local_date - dd).days) <= 3 for dd in solar_dates)
-    is_lunar_in_window = any(abs((local_date - dd).days) <= 3 for dd in lunar_dates)
-    solar_ecl_cat = 'да' if is_solar_in_window else 'нет'
-    lunar_ecl_cat = 'да' if is_lunar_in_window else 'нет'
-    is_retro_any, is_station_any, is_ingress_any = 0, 0, 0
-    is_retro_mercury = 0
-    for p_name in PLANETS_TO_TRACK:
-        today, yesterday = get_planet_details(p_name, d), get_planet_details(p_name, d_prev)
-        if today['speed'] < 0:
-            is_retro_any = 1
-            if p_name == 'Mercury': is_retro_mercury = 1
-        if (today['speed'] < 0) != (yesterday['speed'] < 0): is_station_any = 1
-        if today['sign'] != yesterday['sign']: is_ingress_any = 1
-    hard_aspects_count, personal_hard, weighted_hard_score = 0, 0, 0
-    hard_aspect_to_mars = 0
-    planet_positions = {p: get_planet_details(p, d) for p in ASPECT_PLANETS}
-    for p1, p2 in combinations(ASPECT_PLANETS, 2):
-        angle = abs(np.degrees(planet_positions[p1]['lon'] - planet_positions[p2]['lon']))
-        angle = min(angle, 360 - angle)
-        orb = 8 if ('Sun' in [p1,p2] or 'Moon' in [p1,p2]) else 6
-        if abs(angle - 180) <= orb or abs(angle - 90) <= orb:
-            hard_aspects_count += 1
-            if p1 in PERSONAL_PLANETS and p2 in PERSONAL_PLANETS: personal_hard += 1
-            weight = 2 if (p1 in HEAVY_PLANETS or p2 in HEAVY_PLANETS) else 1
-            weighted_hard_score += weight
-            if 'Mars' in [p1, p2]: hard_aspect_to_mars = 1
-    interaction_merc_mars = 1 if (is_retro_mercury == 1 and hard_aspect_to_mars == 1) else 0
-    def yesno(x): return 'да' if x == 1 else 'нет'
-    def bin_hard(n): return '0' if n == 0 else ('1' if n == 1 else '>=2')
-    def bin_weighted_hard(s):
-        if s == 0: return '0'
-        if s <= 2: return '1-2'
-        if s <= 4: return '3-4'
-        return '5+'
+        local = ecl_dates
+    return np.sort(np.array([d.toordinal() - EPOCH_ORDINAL for d in local], dtype=np.int64))
+
+@lru_cache(maxsize=32)
+def solar_eclipse_days(tz: str) -> np.ndarray:
+    return _eclipse_local_days(SOLAR_ECL_DATES, tz)
+
+@lru_cache(maxsize=32)
+def lunar_eclipse_days(tz: str) -> np.ndarray:
+    return _eclipse_local_days(LUNAR_ECL_DATES, tz)
+
+def in_eclipse_window(local_days: np.ndarray, ecl_days: np.ndarray) -> np.ndarray:
+    """Маска дат, попадающих в окно ±ECLIPSE_WINDOW_DAYS дней вокруг любого из затмений."""
+    return (np.abs(local_days[:, None] - ecl_days[None, :]) <= ECLIPSE_WINDOW_DAYS).any(axis=1)
+
+MOON_PHASE_CATS = ['Новолуние', 'Растущая', 'Полнолуние', 'Убывающая']
+LUNAR_DAY_CATS = ['1-7', '8-14', '15-21', '22-30']
+HARD_ASPECTS_CATS = ['0', '1', '>=2']
+WEIGHTED_ASPECTS_CATS = ['0', '1-2', '3-4', '5+']
+YESNO_CATS = ['нет', 'да']
+
+# Границы бинов для np.digitize; фаза 95% еще относится к убывающей луне, поэтому верхняя граница сдвинута на ulp
+PHASE_EDGES = np.array([5.0, 45.0, 55.0, np.nextafter(95.0, np.inf)])
+PHASE_CODES = np.array([0, 1, 2, 3, 0], dtype=np.int8)
+LUNAR_DAY_EDGES = np.array([7, 14, 21])
+WEIGHTED_ASPECTS_EDGES = np.array([0, 2, 4])
+
+# Категории астро-признаков: в расчете хранятся только int8-коды, строки подставляются один раз через Categorical
+ASTRO_CATEGORIES = {
+    'знак_Солнца': SIGNS, 'фаза_луны': MOON_PHASE_CATS, 'lunar_day_cat': LUNAR_DAY_CATS,
+    'hard_aspects_cat': HARD_ASPECTS_CATS, 'pp_hard_aspects_cat': HARD_ASPECTS_CATS,
+    'is_retrograde_any_cat': YESNO_CATS, 'is_station_any_cat': YESNO_CATS, 'is_ingress_any_cat': YESNO_CATS,
+    'солнечное_затмение_cat': YESNO_CATS, 'лунное_затмение_cat': YESNO_CATS, 'is_hecate_moon_cat': YESNO_CATS,
+    'astro_weighted_aspects_cat': WEIGHTED_ASPECTS_CATS, 'astro_moon_voc_proxy_cat': YESNO_CATS,
+    'astro_interaction_merc_mars': YESNO_CATS,
+}
+
+# Позиции планет и флаги их свойств как bool-массивы по индексу планеты в ASPECT_PLANETS
+IDX = {p: i for i, p in enumerate(ASPECT_PLANETS)}
+TRACK_IDX = {p: i for i, p in enumerate(PLANETS_TO_TRACK)}
+_ASPECT_NAMES = np.array(ASPECT_PLANETS)
+IS_LUMINARY = np.isin(_ASPECT_NAMES, ['Sun', 'Moon'])
+IS_PERSONAL = np.isin(_ASPECT_NAMES, PERSONAL_PLANETS)
+IS_HEAVY = np.isin(_ASPECT_NAMES, HEAVY_PLANETS)
+IS_MARS = _ASPECT_NAMES == 'Mars'
+ORB_MAT = np.where(IS_LUMINARY[:, None] | IS_LUMINARY[None, :], 8.0, 6.0)
+WEIGHT_MAT = np.where(IS_HEAVY[:, None] | IS_HEAVY[None, :], 2, 1)
+PERSONAL_MAT = IS_PERSONAL[:, None] & IS_PERSONAL[None, :]
+MARS_MAT = IS_MARS[:, None] | IS_MARS[None, :]
+PAIR_MASK = np.triu(np.ones((len(ASPECT_PLANETS), len(ASPECT_PLANETS)), dtype=bool), 1)
+
+def compute_hard_aspects(lons: np.ndarray) -> dict:
+    """
+    Считает напряженные аспекты (оппозиция/квадрат) между ASPECT_PLANETS сразу для всех дат.
+    lons — матрица долгот в градусах формы (n_dates, len(ASPECT_PLANETS)).
+    """
+    angle = np.abs(lons[:, :, None] - lons[:, None, :])
+    angle = np.minimum(angle, 360 - angle)
+    hard = ((np.abs(angle - 180) <= ORB_MAT) | (np.abs(angle - 90) <= ORB_MAT)) & PAIR_MASK
     return {
-        'знак_Солнца': sun_sign_cat, 'фаза_луны': moon_phase_cat, 'lunar_day_cat': lunar_day_cat,
-        'hard_aspects_cat': bin_hard(hard_aspects_count), 'pp_hard_aspects_cat': bin_hard(personal_hard),
-        'is_retrograde_any_cat': yesno(is_retro_any), 'is_station_any_cat': yesno(is_station_any),
-        'is_ingress_any_cat': yesno(is_ingress_any), 'солнечное_затмение_cat': solar_ecl_cat,
-        'лунное_затмение_cat': lunar_ecl_cat, 'is_hecate_moon_cat': yesno(is_hecate),
-        'astro_weighted_aspects_cat': bin_weighted_hard(weighted_hard_score),
-        'astro_moon_voc_proxy_cat': yesno(is_moon_voc_proxy),
-        'astro_interaction_merc_mars': yesno(interaction_merc_mars),
+        'hard_count': hard.sum(axis=(1, 2)),
+        'personal_hard': (hard & PERSONAL_MAT).sum(axis=(1, 2)),
+        'weighted_hard': (hard * WEIGHT_MAT).sum(axis=(1, 2)),
+        'hard_to_mars': (hard & MARS_MAT).any(axis=(1, 2)),
+    }
+
+def new_moons_between(start: float, end: float) -> np.ndarray:
+    """Отсортированные моменты новолуний (даты ephem) от предшествующего start до первого после end."""
+    moons = [float(ephem.previous_new_moon(start))]
+    while moons[-1] <= end:
+        moons.append(float(ephem.next_new_moon(moons[-1] + 1)))
+    return np.array(moons)
+
+def _compute_astro_group(tz: str, grp: pd.DataFrame) -> dict:
+    """Коды астро-признаков (колонка -> int8-массив) для дат grp['day_local'] одной таймзоны."""
+    dates = pd.DatetimeIndex(grp['day_local'])
+    noon_utc = (dates + pd.Timedelta(hours=12)).tz_localize(tz).tz_convert('UTC')
+    ephem_dates = [ephem.Date(ts.to_pydatetime()) for ts in noon_utc]
+    lons, pct = compute_aspect_lons(ephem_dates)
+    aspects = compute_hard_aspects(lons)
+    sun_sign_idx = (lons[:, IDX['Sun']] // 30).astype(np.int8)
+    is_moon_voc_proxy = lons[:, IDX['Moon']] % 30 > 27
+    local_days = dates.normalize().asi8 // NS_PER_DAY
+    is_solar_in_window = in_eclipse_window(local_days, solar_eclipse_days(tz))
+    is_lunar_in_window = in_eclipse_window(local_days, lunar_eclipse_days(tz))
+    is_retro = np.empty((len(ephem_dates), len(PLANETS_TO_TRACK)), dtype=bool)
+    is_station = np.empty_like(is_retro)
+    is_ingress = np.empty_like(is_retro)
+    for j, p_name in enumerate(PLANETS_TO_TRACK):
+        speed, speed_prev, sign_idx, sign_prev_idx = compute_planet_block(p_name, ephem_dates)
+        is_retro[:, j] = speed < 0
+        is_station[:, j] = (speed < 0) != (speed_prev < 0)
+        is_ingress[:, j] = sign_idx != sign_prev_idx
+    is_retro_mercury = is_retro[:, TRACK_IDX['Mercury']]
+    is_retro_any, is_station_any, is_ingress_any = is_retro.any(axis=1), is_station.any(axis=1), is_ingress.any(axis=1)
+    interaction_merc_mars = is_retro_mercury & aspects['hard_to_mars']
+
+    d = np.asarray(ephem_dates, dtype=np.float64)
+    new_moons = new_moons_between(d.min(), d.max())
+    idx = np.searchsorted(new_moons, d, side='right') - 1
+    lunar_day_num = np.floor(d - new_moons[idx]).astype(np.int64) + 1
+    is_hecate = (new_moons[idx + 1] - d) < 2.5
+    codes = {
+        'знак_Солнца': sun_sign_idx, 'фаза_луны': PHASE_CODES[np.digitize(pct, PHASE_EDGES)],
+        'lunar_day_cat': np.digitize(lunar_day_num, LUNAR_DAY_EDGES, right=True),
+        'hard_aspects_cat': np.minimum(aspects['hard_count'], 2), 'pp_hard_aspects_cat': np.minimum(aspects['personal_hard'], 2),
+        'is_retrograde_any_cat': is_retro_any, 'is_station_any_cat': is_station_any,
+        'is_ingress_any_cat': is_ingress_any, 'солнечное_затмение_cat': is_solar_in_window,
+        'лунное_затмение_cat': is_lunar_in_window, 'is_hecate_moon_cat': is_hecate,
+        'astro_weighted_aspects_cat': np.digitize(aspects['weighted_hard'], WEIGHTED_ASPECTS_EDGES, right=True),
+        'astro_moon_voc_proxy_cat': is_moon_voc_proxy,
+        'astro_interaction_merc_mars': interaction_merc_mars,
     }
+    return {col: np.asarray(v, dtype=np.int8) for col, v in codes.items()}
+
+def compute_astro_features(keys: pd.DataFrame, n_jobs: int = None) -> pd.DataFrame:
+    """
+    Батч-расчет астрологических признаков для уникальных пар (day_local, tz).
+    Долготы планет считаются один раз на дату, аспекты — матричными операциями NumPy.
+    Даты каждой таймзоны режутся на куски по ASTRO_CHUNK_SIZE и считаются параллельно.
+    """
+    n_jobs = ASTRO_N_JOBS if n_jobs is None else n_jobs
+    tasks = []
+    for tz, grp in keys.groupby('tz', observed=True, sort=False):
+        grp = grp.sort_values('day_local')
+        tasks += [(tz, grp.iloc[i:i + ASTRO_CHUNK_SIZE]) for i in range(0, len(grp), ASTRO_CHUNK_SIZE)]
+    if not tasks:
+        return pd.DataFrame(columns=['day_local', 'tz'])
+    # Процессов не больше, чем задач: на малых инкрементах кэша пул не поднимает простаивающие процессы
+    n_jobs = min(joblib.effective_n_jobs(n_jobs), len(tasks))
+    if n_jobs > 1:
+        # multiprocessing передает воркер в процессы по ссылке (имя модуля + имя функции). Если main.py
+        # импортирован под другим именем (importlib, ноутбук), ссылка не разрешается — считаем последовательно
+        try:
+            pickle.dumps(_compute_astro_group)
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            print(f"[WARN] Параллельные астро-расчеты недоступны ({e}); выполняем последовательно. Задайте ASTRO_N_JOBS = 1, чтобы отключить попытку.")
+            n_jobs = 1
+    if n_jobs == 1:
+        codes = [_compute_astro_group(tz, chunk) for tz, chunk in tqdm(tasks, desc="    Астро-расчеты")]
+    else:
+        # ephem-объекты не сериализуются cloudpickle, поэтому используем multiprocessing-бэкенд. Он не отдает
+        # результаты генератором, а tqdm по отправке задач дошел бы до 100% до окончания расчетов — без прогресс-бара
+        print(f"    Астро-расчеты: {len(tasks)} задач в {n_jobs} процессах...")
+        codes = Parallel(n_jobs=n_jobs, backend='multiprocessing')(
+            delayed(_compute_astro_group)(tz, chunk) for tz, chunk in tasks
+        )
+    # Колонки кусков склеиваются как массивы кодов, DataFrame и Categorical строятся один раз
+    result = pd.concat([chunk[['day_local', 'tz']] for _, chunk in tasks], ignore_index=True)
+    for col, categories in ASTRO_CATEGORIES.items():
+        result[col] = pd.Categorical.from_codes(np.concatenate([c[col] for c in codes]), categories=categories)
+    return result
+
+def get_astro_features_cached(keys: pd.DataFrame, cache_path: Path = None) -> pd.DataFrame:
+    """Астро-признаки для пар (day_local, tz) с кэшем в parquet: ephem считается только для новых ключей."""
+    cache_path = cache_path or ASTRO_CACHE_PATH
+    keys = keys[['day_local', 'tz']].astype({'tz': str}).reset_index(drop=True)
+    keys['day_local'] = pd.to_datetime(keys['day_local'])
+    cached = pd.DataFrame(columns=['day_local', 'tz'])
+    if cache_path.exists():
+        try:
+            cached = pd.read_parquet(cache_path)
+            if not all(c in cached.columns and cached[c].dtype.name == 'category' for c in ASTRO_CAT_BINS):
+                cached = pd.DataFrame(columns=['day_local', 'tz'])
+        except Exception as e:
+            print(f"[WARN] Не удалось прочитать кэш астро-признаков {cache_path}: {e}")
+    missing = keys.merge(cached[['day_local', 'tz']], on=['day_local', 'tz'], how='left', indicator=True)
+    missing = missing.loc[missing['_merge'] == 'left_only', ['day_local', 'tz']]
+    if not missing.empty:
+        computed = compute_astro_features(missing)
+        cached = computed if cached.empty else pd.concat([cached, computed], ignore_index=True)
+        try:
+            cached.to_parquet(cache_path, index=False, compression='zstd')
+        except Exception as e:
+            print(f"[WARN] Не удалось сохранить кэш астро-признаков {cache_path}: {e}")
+    return keys.merge(cached, on=['day_local', 'tz'], how='left')
 
 
 # ============================================================
@@ -352,35 +566,67 @@ CALENDAR_COMPACT_CAT = [
     'cal_long_weekend','cal_school_break_ext', 'cal_payday_proximity', 'cal_is_blue_monday'
 ]
 
-def add_calendar_compact_features(df: pd.DataFrame, date_col_local='day_local', date_col_msk='msk_day') -> pd.DataFrame:
-    out = df.copy()
-    d = pd.to_datetime(out[date_col_msk] if date_col_msk in out.columns else out[date_col_local], errors='coerce')
-    def map_weekday_bucket(x):
-        if pd.isna(x): return 'NA'
-        x = int(x)
-        if x in (0,1,2): return 'пн-ср'
-        if x in (3,4):   return 'чт-пт'
-        if x == 5:       return 'сб'
-        return 'вс'
-    out['cal_weekday_4'] = d.dt.dayofweek.map(map_weekday_bucket).astype('category')
+# Справочники по номеру дня недели (0 = пн) и месяца (0 = дата не распознана)
+WEEKDAY_LUT = np.array(['пн-ср', 'пн-ср', 'пн-ср', 'чт-пт', 'чт-пт', 'сб', 'вс'])
+HOLIDAY_PROX_LUT = np.array(['H-2', 'H-1', 'H0', 'H+1', 'H+2'])
+SEASON_LUT = np.array(['NA', 'Зима', 'Зима', 'Весна', 'Весна', 'Весна', 'Лето', 'Лето', 'Лето', 'Осень', 'Осень', 'Осень', 'Зима'])
+# Школьные каникулы по (месяц, день); нулевые строка/столбец — дата не распознана
+SCHOOL_BREAK_LUT = np.full((13, 32), 'нет', dtype=object)
+SCHOOL_BREAK_LUT[6:9, 1:] = 'лето'
+SCHOOL_BREAK_LUT[1, 1:10] = 'зима'
+SCHOOL_BREAK_LUT[3, 25:] = 'весна'
+SCHOOL_BREAK_LUT[10, 26:] = 'осень'
+SCHOOL_BREAK_LUT[11, 1:5] = 'осень'
+
+@lru_cache(maxsize=None)
+def ru_holiday_map(year_from: int, year_to: int) -> dict:
+    """
+    Словарь {дата: название} праздников РФ за годы year_from..year_to; кэшируется в памяти и в HOLIDAYS_CACHE_PATH.
+    Файл хранит объединение всех запрошенных лет и версию пакета holidays: при обновлении пакета
+    (новые переносы выходных) кэш пересчитывается.
+    """
+    years = set(range(year_from, year_to + 1))
+    cached = {}
+    if HOLIDAYS_CACHE_PATH.exists():
+        try:
+            cached = joblib.load(HOLIDAYS_CACHE_PATH)
+            if cached.get('version') != holidays.__version__:
+                cached = {}
+        except Exception as e:
+            print(f"[WARN] Не удалось прочитать кэш праздников {HOLIDAYS_CACHE_PATH}: {e}")
+            cached = {}
+    cached_years, hol_map = cached.get('years', set()), cached.get('map', {})
+    missing = years - cached_years
+    if missing:
+        hol_map = {**hol_map, **holidays.Russia(years=sorted(missing))}
+        try:
+            joblib.dump({'version': holidays.__version__, 'years': cached_years | years, 'map': hol_map}, HOLIDAYS_CACHE_PATH)
+        except Exception as e:
+            print(f"[WARN] Не удалось сохранить кэш праздников {HOLIDAYS_CACHE_PATH}: {e}")
+    return {day: name for day, name in hol_map.items() if year_from <= day.year <= year_to}
+
+def build_calendar_compact_features(df: pd.DataFrame, date_col_local='day_local', date_col_msk='msk_day') -> pd.DataFrame:
+    """Календарные признаки CALENDAR_COMPACT_CAT: только новые колонки, индекс совпадает с df."""
+    out = pd.DataFrame(index=df.index)
+    d = pd.to_datetime(df[date_col_msk] if date_col_msk in df.columns else df[date_col_local], errors='coerce')
+    is_na = d.isna().to_numpy()
+    out['cal_weekday_4'] = pd.Categorical(np.where(is_na, 'NA', WEEKDAY_LUT[d.dt.dayofweek.fillna(0).to_numpy(dtype=int)]), categories=['пн-ср', 'чт-пт', 'сб', 'вс', 'NA'])
     first_dom = d - pd.to_timedelta(d.dt.day - 1, unit='D')
     wom = 1 + ((d.dt.day + first_dom.dt.dayofweek - 1) // 7)
-    out['cal_week_of_month'] = wom.clip(lower=1, upper=5).map(lambda x: f'W{int(x)}' if pd.notna(x) else 'NA').astype('category')
-    def month_phase(day):
-        if pd.isna(day): return 'NA'
-        day = int(day)
-        if day <= 10: return 'начало'
-        if day <= 20: return 'середина'
-        return 'конец'
-    out['cal_month_phase3'] = d.dt.day.map(month_phase).astype('category')
-    out['cal_quarter'] = d.dt.quarter.map({1:'Q1',2:'Q2',3:'Q3',4:'Q4'}).astype('category')
-    out['cal_season']  = d.dt.month.map(lambda m: 'Зима' if m in (12,1,2) else ('Весна' if m in (3,4,5) else ('Лето' if m in (6,7,8) else 'Осень'))).astype('category')
+    wom = wom.clip(lower=1, upper=5)
+    out['cal_week_of_month'] = pd.Categorical(np.where(wom.isna(), 'NA', 'W' + wom.fillna(0).astype(int).astype(str)), categories=['W1', 'W2', 'W3', 'W4', 'W5', 'NA'])
+    day_num = d.dt.day.to_numpy()
+    out['cal_month_phase3'] = pd.Categorical(np.select([is_na, day_num <= 10, day_num <= 20], ['NA', 'начало', 'середина'], default='конец'), categories=['начало', 'середина', 'конец', 'NA'])
+    quarter = d.dt.quarter
+    out['cal_quarter'] = pd.Categorical(np.where(quarter.isna(), 'NA', 'Q' + quarter.fillna(0).astype(int).astype(str)), categories=['Q1', 'Q2', 'Q3', 'Q4', 'NA'])
+    out['cal_season']  = pd.Categorical(SEASON_LUT[d.dt.month.fillna(0).to_numpy(dtype=int)], categories=['Зима', 'Весна', 'Лето', 'Осень', 'NA'])
     cal_dates = pd.date_range(d.min(), d.max(), freq='D') if d.notna().any() else pd.DatetimeIndex([])
     if len(cal_dates) > 0:
-        ru_hol = holidays.Russia(years=sorted(cal_dates.year.unique()))
+        hol_map = ru_holiday_map(int(cal_dates.year.min()), int(cal_dates.year.max()))
         cal_df = pd.DataFrame(index=cal_dates); cal_df.index.name = 'cal_day'
-        cal_df['is_holiday'] = cal_df.index.to_series().map(lambda x: 1 if x.date() in ru_hol else 0).astype(int)
-        cal_df['hol_name'] = cal_df.index.to_series().map(lambda x: ru_hol.get(x.date(), '')).astype(str)
+        hol_names = np.array([hol_map.get(x, '') for x in cal_df.index.date], dtype=object)
+        cal_df['hol_name'] = hol_names
+        cal_df['is_holiday'] = (hol_names != '').astype(np.int8)
         def map_holiday_type(name):
             if not name or str(name).strip()=='':
                 return 'нет'
@@ -396,23 +642,21 @@ def add_calendar_compact_features(df: pd.DataFrame, date_col_local='day_local',
         cal_df['d_prev'] = (cal_df['i'] - cal_df['prev_h_i']).fillna(9999)
         cal_df['next_h_i'] = np.where(cal_df['is_holiday']==1, cal_df['i'], np.nan); cal_df['next_h_i'] = cal_df['next_h_i'].bfill()
         cal_df['d_next'] = (cal_df['next_h_i'] - cal_df['i']).fillna(9999)
-        def nearest_delta(row):
-            if row['is_holiday'] == 1: return 0
-            a, b = row['d_prev'], row['d_next']
-            return int(a) if abs(a) <= abs(b) else int(b)
-        def prox_cat(v):
-            if v == 0:  return 'H0'
-            elif v == -1: return 'H-1'
-            elif v == -2: return 'H-2'
-            elif v == 1:  return 'H+1'
-            elif v == 2:  return 'H+2'
-            else:        return 'нет_рядом'
-        cal_df['holiday_prox'] = cal_df.apply(nearest_delta, axis=1).map(prox_cat).astype('category')
-        is_weekend = (cal_df.index.dayofweek >= 5).astype(int)
+        # Смещение ближайшего праздника относительно дня: прошедший — со знаком минус, будущий — с плюсом
+        signed_prev, nxt = -cal_df['d_prev'].to_numpy(), cal_df['d_next'].to_numpy()
+        delta = np.where(np.abs(signed_prev) <= np.abs(nxt), signed_prev, nxt).astype(int)
+        delta[cal_df['is_holiday'].to_numpy() == 1] = 0
+        cal_df['holiday_prox'] = pd.Categorical(np.where(np.abs(delta) <= 2, HOLIDAY_PROX_LUT[np.clip(delta, -2, 2) + 2], 'нет_рядом'), categories=HOLIDAY_PROX_LUT.tolist() + ['нет_рядом'])
+        is_weekend = (cal_df.index.dayofweek >= 5).astype(np.int8)
         cal_df['is_nonwork'] = np.maximum(is_weekend, cal_df['is_holiday'])
-        end3 = cal_df['is_nonwork'].rolling(3, min_periods=3).sum().eq(3)
-        long_any = end3 | end3.shift(1, fill_value=False) | end3.shift(2, fill_value=False)
-        cal_df['long_weekend'] = long_any.map({True:'да', False:'нет'}).astype('category')
+        # День входит в длинные выходные, если попадает в окно из 3+ подряд нерабочих дней
+        nonwork = cal_df['is_nonwork'].to_numpy().astype(bool)
+        start3 = np.zeros(len(nonwork), dtype=bool)
+        start3[:-2] = nonwork[:-2] & nonwork[1:-1] & nonwork[2:]
+        long_any = start3.copy()
+        long_any[1:] |= start3[:-1]
+        long_any[2:] |= start3[:-2]
+        cal_df['long_weekend'] = pd.Categorical.from_codes(long_any.astype(np.int8), ['нет', 'да'])
         cal_df['blue_monday'] = np.where(
             (cal_df.index.dayofweek == 0) & (cal_df['long_weekend'].shift(1).eq('да')),
             'да', 'нет'
@@ -425,36 +669,26 @@ def add_calendar_compact_features(df: pd.DataFrame, date_col_local='day_local',
         out['cal_holiday_type4']  = tmp['hol_type4'].fillna('нет').astype('category')
         out['cal_holiday_window5'] = tmp['holiday_prox'].fillna('нет_рядом').astype('category')
         out['cal_long_weekend']    = tmp['long_weekend'].fillna('нет').astype('category')
-        weekend = d.dt.dayofweek >= 5
-        def day_type(is_h, is_w):
-            if is_h == 1: return 'праздник'
-            if is_w: return 'выходной'
-            return 'рабочий'
-        out['cal_day_type3'] = [day_type(h, w) for h, w in zip(tmp['is_holiday'].fillna(0).astype(int), weekend)]
-        out['cal_day_type3'] = out['cal_day_type3'].astype('category')
+        is_h = tmp['is_holiday'].fillna(0).to_numpy(dtype=np.int8)
+        is_w = (d.dt.dayofweek.to_numpy() >= 5).astype(np.int8)
+        day_type_codes = np.where(is_h == 1, 2, np.where(is_w == 1, 1, 0)).astype(np.int8)
+        out['cal_day_type3'] = pd.Categorical.from_codes(day_type_codes, ['рабочий', 'выходной', 'праздник'])
         out['cal_is_blue_monday'] = tmp['blue_monday'].fillna('нет').astype('category')
     else:
         out[['cal_holiday_type4','cal_holiday_window5','cal_long_weekend','cal_day_type3','cal_is_blue_monday']] =             pd.DataFrame([['нет', 'нет_рядом', 'нет', 'рабочий', 'нет']], index=out.index).astype('category')
-    def school_break_ext(dt):
-        if pd.isna(dt): return 'нет'
-        m, day = int(dt.month), int(dt.day)
-        if m == 1 and day <= 9: return 'зима'
-        if m == 3 and day >= 25: return 'весна'
-        if (m == 10 and day >= 26) or (m == 11 and day <= 4): return 'осень'
-        if m in (6,7,8): return 'лето'
-        return 'нет'
-    out['cal_school_break_ext'] = d.map(school_break_ext).astype('category')
-    day = d.dt.day
-    dist_to_10 = np.minimum(abs(day - 10), abs(day - 10 - d.dt.days_in_month))
-    dist_to_25 = np.minimum(abs(day - 25), abs(day - 25 - d.dt.days_in_month))
-    min_dist = np.minimum(dist_to_10, dist_to_25)
-    def payday_prox_cat(dv):
-        if pd.isna(dv): return 'далеко'
-        if dv == 0: return 'день выплаты'
-        if dv <= 2: return 'рядом (±2 дня)'
-        if dv <= 7: return 'неделя до/после'
-        return 'далеко'
-    out['cal_payday_proximity'] = min_dist.map(payday_prox_cat).astype('category')
+    month_num = d.dt.month.fillna(0).to_numpy(dtype=int)
+    out['cal_school_break_ext'] = pd.Categorical(SCHOOL_BREAK_LUT[month_num, d.dt.day.fillna(0).to_numpy(dtype=int)], categories=['нет', 'зима', 'весна', 'лето', 'осень'])
+    # Расстояние до выплат 10-го и 25-го числа, включая 10-е следующего месяца и 25-е предыдущего
+    dim = d.dt.days_in_month.to_numpy()
+    prev_dim = (d - pd.to_timedelta(d.dt.day, unit='D')).dt.day.to_numpy()
+    min_dist = np.minimum.reduce([
+        np.abs(day_num - 10), dim - day_num + 10,
+        np.abs(day_num - 25), dim - day_num + 25, day_num + prev_dim - 25,
+    ])
+    out['cal_payday_proximity'] = pd.Categorical(
+        np.select([min_dist == 0, min_dist <= 2, min_dist <= 7], ['день выплаты', 'рядом (±2 дня)', 'неделя до/после'], default='далеко'),
+        categories=['день выплаты', 'рядом (±2 дня)', 'неделя до/после', 'далеко']
+    )
     return out
 
 
@@ -471,55 +705,58 @@ WEATHER_COMPACT_CAT = [
     'mag_storm_level_cat', 'mag_storm_change_cat'
 ]
 
-def add_astro_tension_index(enriched: pd.DataFrame, windows=ASTRO_TENSION_WINDOW) -> pd.DataFrame:
-    df = enriched.copy()
+def build_astro_tension_index(df: pd.DataFrame, windows=ASTRO_TENSION_WINDOW) -> pd.DataFrame:
+    """Индекс астро-напряженности astro_tension_last{w}_cat: только новые колонки, индекс совпадает с df."""
     event_weights = {'is_retrograde_any_cat': 1, 'is_ingress_any_cat': 2, 'is_station_any_cat': 3, 'лунное_затмение_cat': 5, 'солнечное_затмение_cat': 5}
     astro_flags = [c for c in event_weights.keys() if c in df.columns]
     if not astro_flags:
-        return df
+        return pd.DataFrame(index=df.index)
     unique_dates = df[['tz', 'day_local'] + astro_flags].dropna(subset=['day_local']).drop_duplicates()
     unique_dates.sort_values(['tz', 'day_local'], inplace=True)
+    weighted = sum((unique_dates[col] == 'да').astype(np.int16) * event_weights[col] for col in astro_flags)
+    # Сумма весов за w предыдущих дат таймзоны как разность кумулятивных сумм
+    csum = weighted.groupby(unique_dates['tz'], observed=True).cumsum()
+    csum_by_tz = csum.groupby(unique_dates['tz'], observed=True)
     for w in windows:
-        tension_score = pd.Series(0.0, index=unique_dates.index)
-        for col, weight in event_weights.items():
-            if col in unique_dates.columns:
-                flag_series = unique_dates[col].map({'да': 1, 'нет': 0}).fillna(0)
-                sum_in_window = flag_series.groupby(unique_dates['tz']).transform(lambda s: s.shift(1).rolling(w, min_periods=1).sum()).fillna(0)
-                tension_score += sum_in_window * weight
-        def bin_tension(v):
-            v = int(v)
-            if v == 0: return 'Спокойно'
-            if v <= 4: return 'Легкое напряжение'
-            if v <= 9: return 'Среднее напряжение'
-            if v <= 14: return 'Высокое напряжение'
-            return 'Очень высокое'
-        unique_dates[f'astro_tension_last{w}_cat'] = tension_score.map(bin_tension).astype('category')
-        df = df.merge(unique_dates[['tz', 'day_local', f'astro_tension_last{w}_cat']], on=['tz', 'day_local'], how='left')
-    return df
-
-def compute_daylight_features(lat, lon, day_local, tz):
-    try:
-        local_midnight_utc = pd.Timestamp(day_local).tz_localize(tz).tz_convert('UTC')
-        obs = ephem.Observer(); obs.lat, obs.lon, obs.elevation = str(lat), str(lon), 0
-        obs.date = ephem.Date(local_midnight_utc.to_pydatetime())
-        sun = ephem.Sun()
-        try:
-            sr_utc = obs.next_rising(sun, use_center=True)
-            ss_utc = obs.next_setting(sun, use_center=True)
-            day_length_hours = float((ss_utc - sr_utc) * 24.0)
-            return {'day_length_hours': day_length_hours}
-        except ephem.AlwaysUpError:
-            return {'day_length_hours': 24.0}
-        except ephem.NeverUpError:
-            return {'day_length_hours': 0.0}
-    except Exception:
-        return {'day_length_hours': np.nan}
+        tension_score = (csum_by_tz.shift(1).fillna(0) - csum_by_tz.shift(w + 1).fillna(0)).to_numpy()
+        unique_dates[f'astro_tension_last{w}_cat'] = pd.Categorical(np.select(
+            [tension_score == 0, tension_score <= 4, tension_score <= 9, tension_score <= 14],
+            ['Спокойно', 'Легкое напряжение', 'Среднее напряжение', 'Высокое напряжение'], default='Очень высокое'
+        ), categories=['Спокойно', 'Легкое напряжение', 'Среднее напряжение', 'Высокое напряжение', 'Очень высокое'])
+    tension_cols = [f'astro_tension_last{w}_cat' for w in windows]
+    out = df[['tz', 'day_local']].merge(unique_dates[['tz', 'day_local'] + tension_cols], on=['tz', 'day_local'], how='left')
+    out.index = df.index
+    return out[tension_cols]
+
+DAYLIGHT_ALTITUDE_DEG = 0.5667  # Рефракция у горизонта: восход/заход по центру диска Солнца
+
+def daylight_hours_vec(lat_deg: float, doy) -> np.ndarray:
+    """
+    Длина светового дня (часы) для широты lat_deg по массиву номеров дня года (модель CBM, Forsythe 1995).
+    Полярный день/ночь дают 24/0 за счет ограничения аргумента arccos.
+    """
+    doy = np.asarray(doy, dtype=np.float64)
+    decl = np.arcsin(0.39795 * np.cos(0.2163108 + 2 * np.arctan(0.9671396 * np.tan(0.00860 * (doy - 186)))))
+    lat = np.radians(lat_deg)
+    arg = (np.sin(np.radians(DAYLIGHT_ALTITUDE_DEG)) + np.sin(lat) * np.sin(decl)) / (np.cos(lat) * np.cos(decl))
+    return 24.0 - (24.0 / np.pi) * np.arccos(np.clip(arg, -1.0, 1.0))
+
+@lru_cache(maxsize=None)
+def daylight_lut(lat_deg: float) -> np.ndarray:
+    """Длина дня для дней года 1..366 (индекс doy - 1) на широте lat_deg; считается один раз на широту."""
+    return daylight_hours_vec(lat_deg, np.arange(1, 367))
+
+def daylight_hours_for(lat_deg: float, day_local: pd.Series) -> np.ndarray:
+    """Длина дня для дат day_local по таблице daylight_lut; для NaT — NaN."""
+    doy = day_local.dt.dayofyear
+    hours = daylight_lut(float(lat_deg))[doy.fillna(1).to_numpy(dtype=int) - 1]
+    return np.where(doy.isna(), np.nan, hours)
 
 def prefetch_region_weather_multi_station(region, start_date, end_date):
     if not METEOSTAT_AVAILABLE:
         return pd.DataFrame()
     safe_region = "".join(ch if ch.isalnum() or ch in "._- " else "_" for ch in region)
-    cache_file = CACHE_DIR / f"weather_avg_{safe_region}.parquet"
+    cache_file = CACHE_DIR / f"weather_avg_{safe_region}_{CACHE_VERSION}.parquet"
     if cache_file.exists():
         try:
             cached = pd.read_parquet(cache_file)
@@ -529,21 +766,20 @@ def prefetch_region_weather_multi_station(region, start_date, end_date):
                 return cached
         except Exception as e:
             print(f"[WARN] Не удалось прочитать кэш погоды для региона {region}: {e}")
-    coords_list = REGION_COORDS_MASTER.get(region)
-    if not coords_list:
+    lats, lons = region_coords(region)
+    if not len(lats):
         return pd.DataFrame()
-    tz = region_to_tz(region)
     start_dt = pd.to_datetime(start_date)
     end_dt = pd.to_datetime(end_date)
-    weather_dfs = []
-    for lat, lon in coords_list:
+    def fetch_station(lat, lon):
         try:
-            point = Point(lat, lon)
-            dfw = Daily(point, start_dt - pd.Timedelta(days=1), end_dt).fetch()
-            if dfw is not None and not dfw.empty:
-                weather_dfs.append(dfw)
+            dfw = Daily(Point(lat, lon), start_dt - pd.Timedelta(days=1), end_dt).fetch()
+            return dfw if dfw is not None and not dfw.empty else None
         except Exception:
-            pass
+            return None
+    # Станции региона запрашиваются параллельно: загрузка упирается в сеть, а не в CPU
+    with ThreadPoolExecutor(max_workers=min(METEOSTAT_MAX_WORKERS, len(lats))) as ex:
+        weather_dfs = [dfw for dfw in ex.map(fetch_station, lats.tolist(), lons.tolist()) if dfw is not None]
     if not weather_dfs:
         return pd.DataFrame()
     avg_weather = pd.concat(weather_dfs).groupby(level=0).mean()
@@ -556,12 +792,7 @@ def prefetch_region_weather_multi_station(region, start_date, end_date):
     mask_na = avg_weather['tavg'].isna() & avg_weather['tmin'].notna() & avg_weather['tmax'].notna()
     avg_weather.loc[mask_na, 'tavg'] = (avg_weather.loc[mask_na, 'tmin'] + avg_weather.loc[mask_na, 'tmax']) / 2.0
     avg_weather['region_std'] = region
-    central_lat, central_lon = coords_list[0]
-    dfw_daylight = avg_weather[['day_local']].copy()
-    dfw_daylight['daylight_hours'] = dfw_daylight['day_local'].apply(
-        lambda dt: compute_daylight_features(central_lat, central_lon, dt, tz)['day_length_hours']
-    )
-    avg_weather = avg_weather.merge(dfw_daylight, on='day_local', how='left')
+    avg_weather['daylight_hours'] = daylight_hours_for(lats[0], avg_weather['day_local'])
     avg_weather.rename(columns={'prcp':'precipitation_mm', 'wspd':'wspd_kmh', 'snow':'snow_mm'}, inplace=True)
     try:
         avg_weather.to_parquet(cache_file, index=False)
@@ -569,69 +800,83 @@ def prefetch_region_weather_multi_station(region, start_date, end_date):
         print(f"[WARN] Не удалось сохранить кэш погоды для региона {region}: {e}")
     return avg_weather
 
-def add_weather_compact_cats(df: pd.DataFrame, date_col='day_local', region_col='region_std') -> pd.DataFrame:
-    out = df.copy()
-    out.sort_values([region_col, date_col], inplace=True)
+WEATHER_SOURCE_COLS = ['msk_day', 'tavg', 'wspd_kmh', 'precipitation_mm', 'pres', 'tsun', 'daylight_hours']
+# Погодные категории и исходные метеоданные, от которых они зависят
+WEATHER_CAT_SOURCES = {
+    'wth_sunshine_ratio_cat': ['tsun', 'daylight_hours'], 'wth_daylight_duration_cat': ['daylight_hours'],
+    'wth_temp_feels_like_cat': ['tavg', 'wspd_kmh'], 'wth_seasonal_temp_anomaly_cat': ['tavg'], 'wth_temp_change_cat': ['tavg'],
+    'wth_precipitation_cat': ['precipitation_mm'], 'wth_precipitation_change_cat': ['precipitation_mm'],
+    'wth_wind_speed_cat': ['wspd_kmh'], 'wth_wind_speed_change_cat': ['wspd_kmh'], 'wth_pressure_change_cat': ['pres'],
+}
+WEATHER_CAT_SOURCES_ALL = list(dict.fromkeys(src for sources in WEATHER_CAT_SOURCES.values() for src in sources))
+
+def build_weather_compact_cats(df: pd.DataFrame, date_col='day_local', region_col='region_std') -> pd.DataFrame:
+    """
+    Погодные категории WEATHER_COMPACT_CAT: только новые колонки, индекс совпадает с df.
+    Расчет идет на отсортированной по региону и дате копии нужных колонок, а не всего df.
+    """
+    out = df[[region_col, date_col] + [c for c in WEATHER_SOURCE_COLS if c in df.columns]].sort_values([region_col, date_col])
+    # Источник без единого значения не несет сигнала: его блоки пропускаются, а категории остаются пустыми
+    empty_sources = [c for c in WEATHER_CAT_SOURCES_ALL if c in out.columns and out[c].isna().all()]
+    out = out.drop(columns=empty_sources)
+    by_region = out.groupby(region_col, sort=False, observed=True)
     if 'daylight_hours' in out.columns and 'tsun' in out.columns:
         sun_ratio = (out['tsun'].fillna(0) / 60.0) / out['daylight_hours'].replace(0, np.nan)
         out['wth_sunshine_ratio_cat'] = pd.cut(
             sun_ratio, bins=[-0.1, 0.1, 0.4, 0.7, 1.1],
             labels=['пасмурно', 'облачно', 'переменная облачность', 'ясно'], right=True
-        ).astype('category')
+        )
     if 'daylight_hours' in out.columns:
         out['wth_daylight_duration_cat'] = pd.cut(
             out['daylight_hours'], bins=[-0.1, 8, 12, 16, 24.1],
             labels=['очень короткий', 'короткий', 'длинный', 'очень длинный'], right=True
-        ).astype('category')
+        )
     if {'tavg','wspd_kmh'}.issubset(out.columns):
-        def feels_like(t, w):
-            if pd.isna(t) or pd.isna(w): return np.nan
-            if (t > 10) or (w < 5): return t
-            return 13.12 + 0.6215*t - 11.37*(w**0.16) + 0.3965*t*(w**0.16)
-        out['temp_feels_like'] = out.apply(lambda r: feels_like(r['tavg'], r['wspd_kmh']), axis=1)
+        t, w = out['tavg'].to_numpy(dtype=float), out['wspd_kmh'].to_numpy(dtype=float)
+        w16 = np.power(np.maximum(w, 0), 0.16)
+        wind_chill = 13.12 + 0.6215*t - 11.37*w16 + 0.3965*t*w16
+        feels_like = np.where((t > 10) | (w < 5), t, wind_chill)
+        feels_like[np.isnan(t) | np.isnan(w)] = np.nan
+        out['temp_feels_like'] = feels_like
         out['wth_temp_feels_like_cat'] = pd.cut(
             out['temp_feels_like'],
             bins=[-100, -20, -5, 10, 20, 100],
             labels=['экстр. холод', 'холод', 'прохладно', 'комфорт', 'жара'], right=False
-        ).astype('category')
-    if {'tavg', region_col, date_col}.issubset(out.columns):
-        out['__year'] = out[date_col].dt.year
-        out['__month'] = out[date_col].dt.month
-        monthly_means = out.groupby([region_col, '__year', '__month'])['tavg'].mean().reset_index()
-        monthly_means.sort_values(by=[region_col, '__month', '__year'], inplace=True)
-        historical_expanding_mean = monthly_means.groupby([region_col, '__month'])['tavg'].transform(
-            lambda s: s.shift(1).expanding().mean()
         )
-        monthly_means['seasonal_mean_t'] = historical_expanding_mean
-        monthly_means['seasonal_mean_t'] = monthly_means.groupby([region_col, '__month'])['seasonal_mean_t'].bfill()
-        out = pd.merge(out, monthly_means[[region_col, '__year', '__month', 'seasonal_mean_t']], on=[region_col, '__year', '__month'], how='left')
-        out['__seasonal_temp_anomaly_deg'] = out['tavg'] - out['seasonal_mean_t']
+    if {'tavg', region_col, date_col}.issubset(out.columns):
+        year, month = out[date_col].dt.year.rename('year'), out[date_col].dt.month.rename('month')
+        monthly_means = out['tavg'].groupby([out[region_col], year, month], observed=True).mean().reset_index()
+        monthly_means.sort_values(by=[region_col, 'month', 'year'], inplace=True)
+        by_region_month = monthly_means.groupby([region_col, 'month'], observed=True)['tavg']
+        seasonal_mean_t = by_region_month.transform(lambda s: s.shift(1).expanding().mean())
+        seasonal_mean_t = seasonal_mean_t.groupby([monthly_means[region_col], monthly_means['month']], observed=True).bfill()
+        seasonal_mean_t.index = pd.MultiIndex.from_frame(monthly_means[[region_col, 'year', 'month']])
+        row_seasonal_mean = seasonal_mean_t.reindex(pd.MultiIndex.from_arrays([out[region_col], year, month])).to_numpy()
         out['wth_seasonal_temp_anomaly_cat'] = pd.cut(
-            out['__seasonal_temp_anomaly_deg'],
+            out['tavg'].to_numpy() - row_seasonal_mean,
             bins=[-100, -8, -3, 3, 8, 100],
             labels=['сильно холоднее', 'холоднее нормы', 'норма', 'теплее нормы', 'сильно теплее'],
             right=False
-        ).astype('category')
-        out.drop(columns=['__year', '__month', 'seasonal_mean_t', '__seasonal_temp_anomaly_deg'], inplace=True, errors='ignore')
+        )
     if 'tavg' in out.columns:
-        prev_tavg = out.groupby(region_col)['tavg'].shift(1)
+        prev_tavg = by_region['tavg'].shift(1)
         temp_change = out['tavg'] - prev_tavg
         out['wth_temp_change_cat'] = pd.cut(
             temp_change,
             bins=[-100, -5, -2, 2, 5, 100],
             labels=['сильное похолодание', 'похолодание', 'без изменений', 'потепление', 'сильное потепление'],
             right=False
-        ).astype('category')
+        )
     if 'precipitation_mm' in out.columns:
         out['wth_precipitation_cat'] = pd.cut(
             out['precipitation_mm'].fillna(0),
             bins=[-1, 0, 1, 5, 10000],
             labels=['без осадков', 'легкие', 'умеренные', 'сильные'],
             right=True
-        ).astype('category')
+        )
     if 'precipitation_mm' in out.columns:
         precip_current = out['precipitation_mm'].fillna(0)
-        precip_prev = out.groupby(region_col)['precipitation_mm'].shift(1).fillna(0)
+        precip_prev = by_region['precipitation_mm'].shift(1).fillna(0)
         conditions = [
             precip_prev.isna(),
             (precip_prev <= 0) & (precip_current > 0),
@@ -640,75 +885,89 @@ def add_weather_compact_cats(df: pd.DataFrame, date_col='day_local', region_col=
             (precip_current < precip_prev),
         ]
         choices = ['Без изменений', 'Начались осадки', 'Осадки прекратились', 'Осадки усилились', 'Осадки ослабли']
-        out['wth_precipitation_change_cat'] = pd.Categorical(np.select(conditions, choices, default='Без изменений'))
+        out['wth_precipitation_change_cat'] = pd.Categorical(np.select(conditions, choices, default='Без изменений'), categories=choices)
     if 'wspd_kmh' in out.columns:
         out['wth_wind_speed_cat'] = pd.cut(
             out['wspd_kmh'].fillna(0),
             bins=[-1, 5, 15, 25, 10000],
             labels=['штиль', 'слабый', 'умеренный', 'сильный'],
             right=True
-        ).astype('category')
+        )
     if 'pres' in out.columns:
-        pressure_change = out.groupby(region_col)['pres'].diff()
+        pressure_change = by_region['pres'].diff()
         out['wth_pressure_change_cat'] = pd.cut(
             pressure_change,
             bins=[-1000, -5, -1, 1, 5, 1000],
             labels=['сильное падение', 'падение', 'стабильно', 'рост', 'сильный рост'],
             right=False
-        ).astype('category')
+        )
     if 'wspd_kmh' in out.columns:
-        wind_change = out.groupby(region_col)['wspd_kmh'].diff()
+        wind_change = by_region['wspd_kmh'].diff()
         out['wth_wind_speed_change_cat'] = pd.cut(
             wind_change,
             bins=[-100, -10, -3, 3, 10, 100],
             labels=['сильно стих', 'стих', 'без изменений', 'усилился', 'сильно усилился'],
             right=False
-        ).astype('category')
-    def complex_weather_row(r):
-        p = r.get('precipitation_mm', 0) if pd.notna(r.get('precipitation_mm')) else 0
-        w = r.get('wspd_kmh', 0) if pd.notna(r.get('wspd_kmh')) else 0
-        tfl = r.get('temp_feels_like')
-        if (p > 5) or (w > 25) or (pd.notna(tfl) and tfl < -20): return 'экстремальная'
-        if p > 0: return 'осадки'
-        return 'спокойная'
-    out['wth_complex_weather_cat'] = out.apply(complex_weather_row, axis=1).astype('category')
-    out['__is_bad_weather'] = (out['wth_complex_weather_cat'] != 'спокойная').astype(int)
-    out['__is_extreme_temp'] = out.get('wth_seasonal_temp_anomaly_cat', pd.Series(index=out.index)).isin(['сильно холоднее', 'сильно теплее']).astype(int)
+        )
+    zeros = pd.Series(0.0, index=out.index)
+    p = out.get('precipitation_mm', zeros).fillna(0).to_numpy()
+    w = out.get('wspd_kmh', zeros).fillna(0).to_numpy()
+    tfl = out.get('temp_feels_like', zeros * np.nan).to_numpy(dtype=float)
+    extreme = (p > 5) | (w > 25) | (tfl < -20)
+    out['wth_complex_weather_cat'] = pd.Categorical(np.select([extreme, p > 0], ['экстремальная', 'осадки'], default='спокойная'), categories=['спокойная', 'осадки', 'экстремальная'])
+    out['__is_bad_weather'] = (out['wth_complex_weather_cat'] != 'спокойная').astype(np.int8)
+    out['__is_extreme_temp'] = out.get('wth_seasonal_temp_anomaly_cat', pd.Series(index=out.index)).isin(['сильно холоднее', 'сильно теплее']).astype(np.int8)
     base_cols = [region_col, date_col, '__is_bad_weather', '__is_extreme_temp']
     if 'msk_day' in out.columns:
         base_cols = [region_col, date_col, 'msk_day', '__is_bad_weather', '__is_extreme_temp']
     base = out[base_cols].drop_duplicates().sort_values([region_col, date_col])
-    bad_roll5 = base.groupby(region_col)['__is_bad_weather'].shift(1).rolling(5, min_periods=1).sum().fillna(0)
-    base['wth_bad_weather_last5_cat'] = pd.cut(
+    # Окна «за последние 5 дней» считаются по одной строке на (регион, локальный день)
+    daily = base.drop_duplicates([region_col, date_col]).copy()
+    daily_by_region = daily.groupby(region_col, sort=False, observed=True)
+    bad_roll5 = daily_by_region['__is_bad_weather'].shift(1).rolling(5, min_periods=1).sum().fillna(0)
+    daily['wth_bad_weather_last5_cat'] = pd.cut(
         bad_roll5, bins=[-1, 0, 1, 3, 6],
         labels=['0 дней', '1 день', '2-3 дня', '4-5 дней']
-    ).astype('category')
-    ext_roll5 = base.groupby(region_col)['__is_extreme_temp'].shift(1).rolling(5, min_periods=1).sum().fillna(0)
-    base['wth_extreme_temp_last5_cat'] = pd.cut(
+    )
+    ext_roll5 = daily_by_region['__is_extreme_temp'].shift(1).rolling(5, min_periods=1).sum().fillna(0)
+    daily['wth_extreme_temp_last5_cat'] = pd.cut(
         ext_roll5, bins=[-1, 0, 1, 3, 6],
         labels=['0 дней', '1 день', '2-3 дня', '4+ дней']
-    ).astype('category')
+    )
     agg_date_col = 'msk_day' if 'msk_day' in out.columns else date_col
-    agg = base.groupby(agg_date_col)[['__is_bad_weather', '__is_extreme_temp']].mean().reset_index()
+    # Доли регионов с плохой погодой/аномалией по дням: суммы и счетчики через bincount по кодам дат
+    day_codes, days = pd.factorize(base[agg_date_col], sort=True)
+    valid = day_codes >= 0
+    day_codes = day_codes[valid]
+    n_regions = np.bincount(day_codes, minlength=len(days))
+    agg = pd.DataFrame({agg_date_col: days})
+    for c in ['__is_bad_weather', '__is_extreme_temp']:
+        agg[c] = np.bincount(day_codes, weights=base[c].to_numpy()[valid], minlength=len(days)) / n_regions
     agg['wth_national_bad_weather_scale_cat'] = pd.cut(
         agg['__is_bad_weather'], bins=[-0.1, 0.1, 0.3, 0.6, 1.1],
         labels=['локально', 'местами', 'многие регионы', 'по всей стране']
-    ).astype('category')
+    )
     agg['wth_national_temp_anomaly_scale_cat'] = pd.cut(
         agg['__is_extreme_temp'], bins=[-0.1, 0.1, 0.3, 0.6, 1.1],
         labels=['локально', 'местами', 'многие регионы', 'по всей стране']
-    ).astype('category')
-    out = out.merge(
-        base[[region_col, date_col, 'wth_bad_weather_last5_cat', 'wth_extreme_temp_last5_cat']],
+    )
+    last5 = out[[region_col, date_col]].merge(
+        daily[[region_col, date_col, 'wth_bad_weather_last5_cat', 'wth_extreme_temp_last5_cat']],
         on=[region_col, date_col], how='left'
-    ).merge(
+    )
+    national = out[[agg_date_col]].merge(
         agg[[agg_date_col, 'wth_national_bad_weather_scale_cat', 'wth_national_temp_anomaly_scale_cat']],
-        left_on=agg_date_col, right_on=agg_date_col, how='left'
+        on=agg_date_col, how='left'
     )
-    for c in WEATHER_COMPACT_CAT:
-        if c in out.columns and out[c].dtype.name != 'category':
+    out = pd.concat([out, last5.drop(columns=[region_col, date_col]).set_axis(out.index), national.drop(columns=[agg_date_col]).set_axis(out.index)], axis=1)
+    for c, sources in WEATHER_CAT_SOURCES.items():
+        if c not in out.columns and any(src in empty_sources for src in sources):
+            out[c] = pd.Categorical(np.full(len(out), np.nan))
+    weather_cols = [c for c in WEATHER_COMPACT_CAT if c in out.columns]
+    for c in weather_cols:
+        if out[c].dtype.name != 'category':
             out[c] = out[c].astype('category')
-    return out
+    return out[weather_cols].reindex(df.index)
 
 def load_magnetic_indices(kp_path: Path, ap_path: Path) -> pd.DataFrame:
     """Загружает Kp и ap индексы, объединяет по дате, агрегирует до уровня дня."""
@@ -742,31 +1001,24 @@ def add_magnetic_storm_features(df: pd.DataFrame, kp_path: Path, ap_path: Path,
         df['mag_storm_change_cat'] = 'данные недоступны'
         return df
 
-    df = df.merge(mag_df[['date', 'Kp_daily']], left_on=date_col_msk, right_on='date', how='left')
+    # Изменение Kp считается между соседними календарными днями ряда индексов, а не между строками df
+    kp_by_day = mag_df.set_index('date')['Kp_daily']
+    mag_df['Kp_change'] = (kp_by_day - kp_by_day.shift(1, freq='D').reindex(kp_by_day.index)).to_numpy()
+    df = df.merge(mag_df[['date', 'Kp_daily', 'Kp_change']], left_on=date_col_msk, right_on='date', how='left')
     df['Kp_daily'] = df['Kp_daily'].fillna(df['Kp_daily'].median())
 
-    def classify_storm_level(kp):
-        if kp <= 4: return 'спокойно'
-        elif kp <= 5: return 'слабая буря'
-        elif kp <= 6: return 'умеренная буря'
-        elif kp <= 8: return 'сильная буря'
-        else: return 'экстремальная буря'
-    df['mag_storm_level_cat'] = df['Kp_daily'].apply(classify_storm_level).astype('category')
-
-    df = df.sort_values(date_col_msk).reset_index(drop=True)
-    df['Kp_prev'] = df['Kp_daily'].shift(1)
-    df['Kp_change'] = df['Kp_daily'] - df['Kp_prev']
-
-    def classify_change(change):
-        if pd.isna(change): return 'нет данных'
-        if change > 1.5: return 'резкий рост'
-        elif change > 0.5: return 'рост'
-        elif change < -1.5: return 'резкое падение'
-        elif change < -0.5: return 'падение'
-        else: return 'стабильно'
-    df['mag_storm_change_cat'] = df['Kp_change'].apply(classify_change).astype('category')
-
-    df.drop(columns=['Kp_daily', 'Kp_prev', 'Kp_change', 'date'], errors='ignore', inplace=True)
+    kp = df['Kp_daily'].to_numpy()
+    df['mag_storm_level_cat'] = pd.Categorical(np.select(
+        [kp <= 4, kp <= 5, kp <= 6, kp <= 8],
+        ['спокойно', 'слабая буря', 'умеренная буря', 'сильная буря'], default='экстремальная буря'
+    ), categories=['спокойно', 'слабая буря', 'умеренная буря', 'сильная буря', 'экстремальная буря'])
+
+    change = df['Kp_change'].to_numpy()
+    df['mag_storm_change_cat'] = pd.Categorical(np.select(
+        [np.isnan(change), change > 1.5, change > 0.5, change < -1.5, change < -0.5],
+        ['нет данных', 'резкий рост', 'рост', 'резкое падение', 'падение'], default='стабильно'
+    ), categories=['резкое падение', 'падение', 'стабильно', 'рост', 'резкий рост', 'нет данных'])
+    df.drop(columns=['Kp_daily', 'Kp_change', 'date'], errors='ignore', inplace=True)
     return df
 
 
@@ -828,28 +1080,67 @@ NEWS_GROUP_WEIGHTS = {
     'Праздники/общество': +1
 }
 
+# Бины news-фич для pd.cut (right=True); np.nextafter делает границу строгой там, где правило было «<», а не «<=»
+_INF = np.inf
+_TONE_BINS = ([-_INF, -2, np.nextafter(-0.5, -_INF), 0.5, np.nextafter(2, -_INF), _INF],
+              ['сильно негативный', 'негативный', 'нейтральный', 'позитивный', 'сильно позитивный'])
+_RISK_BINS = ([-_INF, 0, 1, 3, _INF], ['0', '1', '2-3', '4+'])
+_SMALL_BINS = ([-_INF, 0, 1, _INF], ['0', '1', '2+'])
+NEWS_CUT_BINS = {
+    'news_tone_change_cat': ([-_INF, -2, np.nextafter(0, -_INF), 0, np.nextafter(2, -_INF), _INF],
+                             ['резко негативнее', 'негативнее', 'без изменений', 'позитивнее', 'резко позитивнее']),
+    'news_burst_last5_cat': ([-_INF, 0, 2, 5, _INF], ['0', '1-2', '3-5', '6+']),
+    'news_topics_last5_cat': ([-_INF, 0, 2, 4, _INF], ['0', '1-2', '3-4', '5+']),
+    'news_tone_day_cat': _TONE_BINS,
+    'news_tone_last5_cat': _TONE_BINS,
+    'news_macro_risk_last5_cat': _RISK_BINS,
+    'news_security_risk_last5_cat': _RISK_BINS,
+    'news_it_pay_last5_cat': _SMALL_BINS,
+    'news_energy_last5_cat': _SMALL_BINS,
+    'news_recency_major_cat': ([-_INF, 1, 3, 7, _INF], ['0-1', '2-3', '4-7', '>7']),
+    'news_span_last14_cat': ([-_INF, 2, 5, 9, _INF], ['0-2', '3-5', '6-9', '10-14']),
+}
+
 SEC_HINTS = re.compile(r'(захват|обстрел|бои|боест|ракет|артилл|штурм|прорыв|освобожд|дрг|теракт|паводк|дрон|бпла|взрыв)', re.I)
 
+# Группы новостей проверяются в порядке NEWS_GROUP_PATTERNS: якорная альтернатива из lookahead-ов
+# выбирает первую по порядку группу, чей шаблон встречается где угодно в строке (m.lastgroup -> индекс группы)
+_GROUP_NAMES = list(NEWS_GROUP_PATTERNS)
+_GROUP_RE = re.compile('^(?:' + '|'.join(
+    f"(?=.*?(?:{'|'.join(map(re.escape, pats))}))(?P<g{i}>)" for i, pats in enumerate(NEWS_GROUP_PATTERNS.values())
+) + ')', re.S)
+_FLAT_PATS = tuple(p for pats in NEWS_GROUP_PATTERNS.values() for p in pats)
+_ALL_PATS_RE = re.compile('|'.join(map(re.escape, _FLAT_PATS)))
+_PAREN_RE = re.compile(r'\(.*?\)')
+_SEC_WORDS_RE = re.compile(r'\b(захват|взятие?|освобожден\w*|освобожд\w*|обстрел\w*|бои|штурм\w*|прорыв\w*|контр\w*|интенсив\w*|продолжение|попытка|провал|новая|после|стаб\w*)\b')
+_NON_ALNUM_RE = re.compile(r'[^а-яa-z0-9]+')
+_WS_RE = re.compile(r'\s+')
+
 def _normalize_cat_text(s: str) -> str:
     s = str(s or '').lower()
     s = s.replace('междунар.', 'международн')
     s = s.replace('чп', 'чс')
-    s = re.sub(r'\s+', ' ', s).strip()
+    s = _WS_RE.sub(' ', s).strip()
     return s
 
-def _map_news_group(cat_raw: str, event_text: str) -> str:
-    s = f"{str(cat_raw)} {str(event_text)}".lower()
-    s = s.replace('междунар.', 'международн').replace('чп', 'чс')
-    for grp, pats in NEWS_GROUP_PATTERNS.items():
-        if any(pat in s for pat in pats):
-            return grp
-    return 'Экономика/налоги/бюджет'
+def _map_news_group(cat_raw: pd.Series, event_text: pd.Series) -> np.ndarray:
+    """Группа новости для всех строк сразу: str.extract по _GROUP_RE, совпавшая группа даёт '' (не NaN)."""
+    s = (cat_raw.astype(str) + ' ' + event_text.astype(str)).str.lower()
+    s = s.str.replace('междунар.', 'международн', regex=False).str.replace('чп', 'чс', regex=False)
+    hit = s.str.extract(_GROUP_RE).notna().to_numpy()
+    codes = np.where(hit.any(axis=1), hit.argmax(axis=1), _GROUP_NAMES.index('Экономика/налоги/бюджет'))
+    return np.asarray(_GROUP_NAMES, dtype=object)[codes]
 
 def _load_events_from_tsv(events_path: Path) -> pd.DataFrame:
-    """Загружает и парсит файл с событиями из TSV."""
+    """Загружает и парсит файл с событиями из TSV (разбор кэшируется по пути и mtime файла)."""
     if not events_path.exists():
         print(f"[WARN] Файл событий не найден по пути: {events_path}")
         return pd.DataFrame(columns=['event_date','event','cat_raw'])
+    return _parse_events_tsv(str(events_path.resolve()), events_path.stat().st_mtime_ns).copy(deep=False)
+
+@lru_cache(maxsize=4)
+def _parse_events_tsv(path_str: str, mtime_ns: int) -> pd.DataFrame:
+    events_path = Path(path_str)
 
     with open(events_path, 'r', encoding='utf-8') as f:
         tsv_text = f.read()
@@ -881,23 +1172,22 @@ def _load_events_from_tsv(events_path: Path) -> pd.DataFrame:
         return ev
 
     ev['cat_norm'] = ev['cat_raw'].apply(_normalize_cat_text)
-    ev['group'] = [_map_news_group(c, e) for c, e in zip(ev['cat_norm'], ev['event'])]
+    ev['group'] = _map_news_group(ev['cat_norm'], ev['event'])
     return ev
 
 def _compress_security_updates(ev: pd.DataFrame) -> pd.DataFrame:
     """Сжимает повторы «боевых» апдейтов в один на день (нормализация текста)."""
     if ev.empty or 'group' not in ev.columns:
         return ev
-    df = ev.copy()
-    mask_sec = df['group'] == 'Безопасность/ЧС'
+    mask_sec = ev['group'] == 'Безопасность/ЧС'
     def norm_event(txt: str) -> str:
         s = str(txt or '').lower()
-        s = re.sub(r'\(.*?\)', ' ', s) # убрать скобки
-        s = re.sub(r'\b(захват|взятие?|освобожден\w*|освобожд\w*|обстрел\w*|бои|штурм\w*|прорыв\w*|контр\w*|интенсив\w*|продолжение|попытка|провал|новая|после|стаб\w*)\b', ' ', s)
-        s = re.sub(r'[^а-яa-z0-9]+', ' ', s)
-        s = re.sub(r'\s+', ' ', s).strip()
+        s = _PAREN_RE.sub(' ', s) # убрать скобки
+        s = _SEC_WORDS_RE.sub(' ', s)
+        s = _NON_ALNUM_RE.sub(' ', s)
+        s = _WS_RE.sub(' ', s).strip()
         return s
-    df['event_norm'] = np.where(mask_sec, df['event'].apply(norm_event), df['event'].str.lower())
+    df = ev.assign(event_norm=np.where(mask_sec, ev['event'].apply(norm_event), ev['event'].str.lower()))
     df = pd.concat([
         df[~mask_sec],
         df[mask_sec].drop_duplicates(subset=['event_date','event_norm'])
@@ -908,10 +1198,10 @@ def _audit_events_for_debug(ev: pd.DataFrame, sample_n: int = 10):
     """Проводит аудит качества разметки новостей."""
     try:
         rep = {}
-        dupl = (ev.assign(_k=lambda x: x['event_date'].astype(str) + ' | ' + x['event'].str.strip().str.lower())
-                  .groupby('_k').size().reset_index(name='n').query('n>1'))
-        rep['duplicates_cnt'] = int(dupl['n'].sum() - len(dupl)) if not dupl.empty else 0
-        hit_mask = ev.apply(lambda r: any(pat in (str(r['cat_norm']) + ' ' + str(r['event'])).lower() for pat in sum(NEWS_GROUP_PATTERNS.values(), [])), axis=1)
+        # Копии сверх первой в каждой паре (дата, событие); события-NaN, как и раньше, не считаются
+        sizes = ev.groupby([ev['event_date'], ev['event'].str.strip().str.lower()]).size()
+        rep['duplicates_cnt'] = int((sizes[sizes > 1] - 1).sum())
+        hit_mask = (ev['cat_norm'].fillna('') + ' ' + ev['event'].fillna('')).str.lower().str.contains(_ALL_PATS_RE)
         rep['default_group_share'] = float(1 - hit_mask.mean()) if len(ev) else 0.0
         mask_sec_hint = ev['event'].str.contains(SEC_HINTS, na=False)
         sec_mis = ev[mask_sec_hint & (ev['group'] != 'Безопасность/ЧС')].head(sample_n)
@@ -925,6 +1215,12 @@ def _audit_events_for_debug(ev: pd.DataFrame, sample_n: int = 10):
     except Exception:
         pass
 
+def shifted_rolling_sum(x: np.ndarray, w: int) -> np.ndarray:
+    """Сумма w предыдущих значений (без текущего) по оси 0, как shift(1).rolling(w, min_periods=1).sum().fillna(0)."""
+    c = np.concatenate([np.zeros((1,) + x.shape[1:], dtype=x.dtype), np.cumsum(x, axis=0)])
+    i = np.arange(len(x))
+    return c[i] - c[np.maximum(i - w, 0)]
+
 def build_news_compact_features(
     df: pd.DataFrame,
     events_path: Path,
@@ -932,12 +1228,12 @@ def build_news_compact_features(
     **kwargs
 ) -> pd.DataFrame:
     """Строит компактные news-фичи."""
-    out = df.copy()
+    out = df
 
     ev_raw = _load_events_from_tsv(events_path)
 
     if kwargs.get('audit_print', NEWS_CONFIG['audit_print']):
-        _audit_events_for_debug(ev_raw.copy())
+        _audit_events_for_debug(ev_raw)
 
     if kwargs.get('compress_security_updates', NEWS_CONFIG['compress_security_updates']):
         ev = _compress_security_updates(ev_raw)
@@ -956,7 +1252,13 @@ def build_news_compact_features(
     if ev.empty or len(full_range) == 0:
         mat = pd.DataFrame(index=full_range)
     else:
-        mat = (ev.groupby(['event_date', 'group']).size().unstack(fill_value=0).reindex(full_range, fill_value=0))
+        # Матрица день×группа одним bincount вместо groupby/unstack/reindex; колонки — все группы событий по алфавиту
+        groups, g_code = np.unique(ev['group'].to_numpy(dtype=object), return_inverse=True)
+        day_pos = (ev['event_date'].to_numpy() - full_range[0].to_datetime64()) // np.timedelta64(1, 'D')
+        in_range = (day_pos >= 0) & (day_pos < len(full_range))
+        counts = np.bincount(day_pos[in_range] * len(groups) + g_code[in_range], minlength=len(full_range) * len(groups))
+        # Счетчики событий за день малы: int16 вместо int64 в 4 раза сокращает матрицу и проходы по ней
+        mat = pd.DataFrame(counts.reshape(len(full_range), len(groups)).astype(np.int16), index=full_range, columns=pd.Index(groups, name='group'))
     mat.index.name = date_col_msk
 
     if mat.shape[1] == 0:
@@ -965,21 +1267,24 @@ def build_news_compact_features(
         tone_day = pd.Series(0.0, index=mat.index, dtype=float)
         pres = pd.DataFrame(index=mat.index)
     else:
-        day_total = mat.sum(axis=1)
+        day_total = mat.sum(axis=1).astype(np.int16)
         day_group = mat.idxmax(axis=1).where(day_total > 0, 'нет')
         w = pd.Series(NEWS_GROUP_WEIGHTS).reindex(mat.columns, fill_value=0)
         tone_day = mat.mul(w, axis=1).sum(axis=1).astype(float)
-        pres = (mat > 0).astype(int)
+        pres = (mat > 0).astype(np.int8)
 
-    burst_last5 = day_total.shift(1).rolling(last_w, min_periods=1).sum().fillna(0)
-    topics_last5 = (pres.shift(1).rolling(last_w, min_periods=1).max().fillna(0)).sum(axis=1) if pres.shape[1] > 0 else pd.Series(0, index=mat.index, dtype=int)
-    tone_last5 = tone_day.shift(1).rolling(last_w, min_periods=1).mean().fillna(0)
+    burst_last5 = pd.Series(shifted_rolling_sum(day_total.to_numpy(), last_w), index=mat.index)
+    # Группа «была» в окне, если сумма ее присутствий за окно > 0 (вместо rolling max)
+    topics_last5 = pd.Series((shifted_rolling_sum(pres.to_numpy(), last_w) > 0).sum(axis=1), index=mat.index) if pres.shape[1] > 0 else pd.Series(0, index=mat.index, dtype=int)
+    n_prev = np.minimum(np.arange(len(tone_day)), last_w)
+    tone_last5 = pd.Series(np.divide(shifted_rolling_sum(tone_day.to_numpy(), last_w), n_prev,
+                                     out=np.zeros(len(tone_day)), where=n_prev > 0), index=mat.index)
 
     def sum_groups_last5(groups):
         if mat.shape[1] == 0: return pd.Series(0, index=mat.index, dtype=float)
         cols = [c for c in mat.columns if c in groups]
         if not cols: return pd.Series(0, index=mat.index, dtype=float)
-        return mat[cols].sum(axis=1).shift(1).rolling(last_w, min_periods=1).sum().fillna(0)
+        return pd.Series(shifted_rolling_sum(mat[cols].sum(axis=1).to_numpy(), last_w), index=mat.index)
 
     macro_groups = {'Санкции/финансы', 'Экономика/налоги/бюджет', 'Политика/право/выборы', 'Денежная политика'}
     security_groups = {'Безопасность/ЧС'}
@@ -998,43 +1303,28 @@ def build_news_compact_features(
         if include_monetary_in_major:
             major_groups.add('Денежная политика')
         cols = [c for c in mat.columns if c in major_groups]
-        major_flag = (mat[cols].sum(axis=1) > 0).astype(int) if cols else pd.Series(0, index=mat.index)
+        major_flag = (mat[cols].to_numpy().sum(axis=1) > 0) if cols else np.zeros(len(mat), dtype=bool)
         idx = np.arange(len(major_flag))
-        last_idx = pd.Series(np.where(major_flag == 1, idx, np.nan), index=mat.index).ffill()
-        recency = (idx - last_idx).fillna(9999).astype(int)
+        last_idx = np.maximum.accumulate(np.where(major_flag, idx, -1))  # индекс последнего «крупного» дня
+        recency = pd.Series(np.where(last_idx < 0, 9999, idx - last_idx), index=mat.index)
 
-    span14 = (day_total > 0).astype(int).shift(1).rolling(long_w, min_periods=1).sum().fillna(0)
+    span14 = pd.Series(shifted_rolling_sum((day_total > 0).to_numpy().astype(int), long_w), index=mat.index)
 
     news_daily = pd.DataFrame(index=mat.index)
     tone_change = tone_day.diff()
-    def cut_tone_change(v):
-        if pd.isna(v): return 'без изменений'
-        if v <= -2: return 'резко негативнее'
-        if v < 0: return 'негативнее'
-        if v >= 2: return 'резко позитивнее'
-        if v > 0: return 'позитивнее'
-        return 'без изменений'
-
-    def cut_burst(x):  return '0' if x <= 0 else ('1-2' if x <= 2 else ('3-5' if x <= 5 else '6+'))
-    def cut_topics(x): return '0' if x <= 0 else ('1-2' if x <= 2 else ('3-4' if x <= 4 else '5+'))
-    def cut_tone(v):   return 'сильно негативный' if v <= -2 else ('негативный' if v < -0.5 else ('нейтральный' if v <= 0.5 else ('позитивный' if v < 2 else 'сильно позитивный')))
-    def cut_macro(x):  return '0' if x <= 0 else ('1' if x == 1 else ('2-3' if x <= 3 else '4+'))
-    def cut_small(x):  return '0' if x <= 0 else ('1' if x == 1 else '2+')
-    def cut_recency(dv):return '0-1' if dv <= 1 else ('2-3' if dv <= 3 else ('4-7' if dv <= 7 else '>7'))
-    def cut_span14(x): return '0-2' if x <= 2 else ('3-5' if x <= 5 else ('6-9' if x <= 9 else '10-14'))
-
-    news_daily['news_tone_change_cat']       = tone_change.map(cut_tone_change).astype('category')
-    news_daily['news_day_group7']            = day_group.astype('category')
-    news_daily['news_burst_last5_cat']       = burst_last5.map(cut_burst).astype('category')
-    news_daily['news_topics_last5_cat']      = topics_last5.map(cut_topics).astype('category')
-    news_daily['news_tone_day_cat']          = tone_day.map(cut_tone).astype('category')
-    news_daily['news_tone_last5_cat']        = tone_last5.map(cut_tone).astype('category')
-    news_daily['news_macro_risk_last5_cat']  = macro_last5.map(cut_macro).astype('category')
-    news_daily['news_security_risk_last5_cat'] = security_last5.map(cut_macro).astype('category')
-    news_daily['news_it_pay_last5_cat']      = itpay_last5.map(cut_small).astype('category')
-    news_daily['news_energy_last5_cat']      = energy_last5.map(cut_small).astype('category')
-    news_daily['news_recency_major_cat']     = recency.map(cut_recency).astype('category')
-    news_daily['news_span_last14_cat']       = span14.map(cut_span14).astype('category')
+    news_daily['news_tone_change_cat'] = pd.cut(tone_change, bins=NEWS_CUT_BINS['news_tone_change_cat'][0],
+                                                labels=NEWS_CUT_BINS['news_tone_change_cat'][1]).fillna('без изменений')
+    news_daily['news_day_group7'] = day_group.astype('category')
+    binned = {
+        'news_burst_last5_cat': burst_last5, 'news_topics_last5_cat': topics_last5,
+        'news_tone_day_cat': tone_day, 'news_tone_last5_cat': tone_last5,
+        'news_macro_risk_last5_cat': macro_last5, 'news_security_risk_last5_cat': security_last5,
+        'news_it_pay_last5_cat': itpay_last5, 'news_energy_last5_cat': energy_last5,
+        'news_recency_major_cat': recency, 'news_span_last14_cat': span14,
+    }
+    for col, ser in binned.items():
+        bins, labels = NEWS_CUT_BINS[col]
+        news_daily[col] = pd.cut(ser, bins=bins, labels=labels)
     news_daily.reset_index(inplace=True)
 
     if 'cal_holiday_type4' in out.columns and len(full_range) > 0:
@@ -1048,10 +1338,11 @@ def build_news_compact_features(
     day_has_event.columns = [date_col_msk, 'has_event_today']
 
     news_daily = news_daily.merge(day_holiday, on='msk_day', how='left').merge(day_has_event, on='msk_day', how='left')
-    def overlay(row):
-        if row['is_hol'] == 0: return 'нет'
-        return 'праздник+события' if row['has_event_today'] == 1 else 'праздник_без_событий'
-    news_daily['news_holiday_overlay_cat'] = news_daily.apply(overlay, axis=1).astype('category')
+    is_hol = news_daily['is_hol'].to_numpy()
+    has_ev = news_daily['has_event_today'].to_numpy()
+    news_daily['news_holiday_overlay_cat'] = pd.Series(
+        np.select([is_hol == 0, has_ev == 1], ['нет', 'праздник+события'], default='праздник_без_событий'),
+        index=news_daily.index).astype('category')
     news_daily = news_daily.drop(columns=['is_hol','has_event_today'], errors='ignore')
 
     out = out.merge(news_daily, on=date_col_msk, how='left')
@@ -1093,6 +1384,19 @@ def build_feature_lists_all(df):
     num_cols = [] # Подставляем числовые признаки
     return cat_cols, num_cols
 
+def as_na_category(s: pd.Series) -> pd.Series:
+    """
+    Категориальная колонка со строковыми категориями, где пропуск — явная категория 'NA'
+    (в таком виде ее получает CatBoost: cat_features допускают только строки и целые числа).
+    """
+    s = s.astype('category')
+    if not all(isinstance(c, str) for c in s.cat.categories):
+        # Нестроковые категории (например, 1.0 из float-колонки) переводятся в str, как прежний astype(str)
+        s = s.astype(object).map(str, na_action='ignore').astype('category')
+    if 'NA' not in s.cat.categories:
+        s = s.cat.add_categories(['NA'])
+    return s.fillna('NA')
+
 def get_feature_group(feature_name):
     """Возвращает высокоуровневую группу для признака."""
     if feature_name in CX_CAT: return 'Опыт клиента (CX)'
@@ -1103,11 +1407,13 @@ def get_feature_group(feature_name):
     if feature_name in NEWS_COMPACT_CAT: return 'Новости'
     return 'Прочее'
 
+_WW_JUNK_RE = re.compile(r'[^0-9eE.\-+,]')  # всё, кроме цифр, экспоненты, знаков и десятичного разделителя
+
 def enrich_data_full(df, date_col='business_dt', region_col='region'):
     """
     Главная функция для обогащения исходного датасета всеми внешними данными.
     """
-    df = df.copy()
+    df = df.copy(deep=False)  # при copy-on-write данные не копируются, новые колонки не попадают в исходный df
     initial_cols = df.columns.tolist()
 
     print("  - Нормализация регионов и определение таймзон...")
@@ -1122,24 +1428,21 @@ def enrich_data_full(df, date_col='business_dt', region_col='region'):
     else:
         base_msk = ser.dt.tz_convert('Europe/Moscow')
     df['msk_day'] = base_msk.dt.normalize().dt.tz_localize(None)
-    df['day_local'] = pd.NaT
-    for tz in df['tz'].cat.categories:
-        mask = (df['tz'] == tz)
-        if not mask.any(): continue
-        loc = base_msk[mask].dt.tz_convert(tz)
-        df.loc[mask, 'day_local'] = loc.dt.normalize().dt.tz_localize(None)
+    # Позиции строк каждой таймзоны берутся за один проход groupby (без K масок по всему столбцу);
+    # tz_convert по группе точен и при переходах на летнее время, результат пишется в один массив
+    day_local = np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+    for tz, pos in df.groupby('tz', observed=True, sort=False).indices.items():
+        day_local[pos] = base_msk.iloc[pos].dt.tz_convert(tz).dt.normalize().dt.tz_localize(None).to_numpy()
+    df['day_local'] = day_local
 
     print("  - Расчет астрологических факторов...")
     keys = df[['day_local','tz']].dropna().drop_duplicates()
-    astro_rows = [
-        {'day_local': r.day_local, 'tz': r.tz, **get_astro_cats_only(r.day_local, r.tz)}
-        for r in tqdm(keys.itertuples(index=False), total=len(keys), desc="    Астро-расчеты")
-    ]
-    if astro_rows:
-        df = df.merge(pd.DataFrame(astro_rows), on=['day_local','tz'], how='left')
+    astro_df = get_astro_features_cached(keys)
+    if not astro_df.empty:
+        df = df.merge(astro_df, on=['day_local','tz'], how='left')
 
     print("  - Расчет календарных признаков...")
-    df = add_calendar_compact_features(df)
+    df = pd.concat([df, build_calendar_compact_features(df)], axis=1)
 
     print("  - Загрузка и обработка погодных данных...")
     weather_keys = df[['region_std','day_local']].dropna()
@@ -1156,26 +1459,18 @@ def enrich_data_full(df, date_col='business_dt', region_col='region'):
         keep_wx = [c for c in weather_features.columns if c in ['region_std','day_local','daylight_hours','tavg','wspd_kmh','precipitation_mm','pres','tsun']]
         weather_features = weather_features[keep_wx]
         df = df.merge(weather_features, on=['region_std','day_local'], how='left')
-        df = add_weather_compact_cats(df, date_col='day_local', region_col='region_std')
+        df = pd.concat([df, build_weather_compact_cats(df, date_col='day_local', region_col='region_std')], axis=1)
     else:
         # Резервный расчет только длины дня, если meteostat недоступен
         print("    [INFO] Meteostat недоступен. Расчет только длины светового дня.")
         if not df.empty:
             df['daylight_hours'] = np.nan
-            unique_region_tz = df[['region_std', 'tz']].drop_duplicates()
-            for _, row in tqdm(unique_region_tz.iterrows(), total=len(unique_region_tz), desc="    Расчет длины дня"):
-                region_name, tz = row['region_std'], row['tz']
-                coords_list = REGION_COORDS_MASTER.get(region_name)
-                if coords_list:
-                    lat, lon = coords_list[0]
+            for region_name in tqdm(df['region_std'].dropna().unique(), desc="    Расчет длины дня"):
+                lats, lons = region_coords(region_name)
+                if len(lats):
                     mask_region = df['region_std'] == region_name
-                    unique_dates = df.loc[mask_region, 'day_local'].dropna().unique()
-                    daylight_map = {
-                        dt: compute_daylight_features(lat, lon, dt, tz).get('day_length_hours')
-                        for dt in unique_dates
-                    }
-                    df.loc[mask_region, 'daylight_hours'] = df.loc[mask_region, 'day_local'].map(daylight_map)
-            df['wth_daylight_duration_cat'] = pd.cut(df['daylight_hours'], bins=[-0.1, 8, 12, 16, 24.1], labels=['очень короткий', 'короткий', 'длинный', 'очень длинный']).astype('category')
+                    df.loc[mask_region, 'daylight_hours'] = daylight_hours_for(lats[0], df.loc[mask_region, 'day_local'])
+            df['wth_daylight_duration_cat'] = pd.cut(df['daylight_hours'], bins=[-0.1, 8, 12, 16, 24.1], labels=['очень короткий', 'короткий', 'длинный', 'очень длинный'])
 
 
     print("  - Расчет новостных факторов...")
@@ -1186,12 +1481,12 @@ def enrich_data_full(df, date_col='business_dt', region_col='region'):
 
     print("  - Финальная обработка и очистка...")
     if 'ww' in df.columns:
-        s = df['ww'].astype(str).replace(r',','.', regex=True).replace(r'[^0-9eE\.\-\+]', '', regex=True)
+        s = df['ww'].astype(str).str.replace(_WW_JUNK_RE, '', regex=True).str.replace(',', '.', regex=False)
         df['ww_weight'] = pd.to_numeric(s, errors='coerce').fillna(1.0)
     else:
         df['ww_weight'] = 1.0
 
-    df = add_astro_tension_index(df, windows=ASTRO_TENSION_WINDOW)
+    df = pd.concat([df, build_astro_tension_index(df, windows=ASTRO_TENSION_WINDOW)], axis=1)
 
     cat_cols, _ = build_feature_lists_all(df)
     keep_cols = initial_cols + ['day_local', 'msk_day', 'ww_weight'] + cat_cols
@@ -1200,10 +1495,41 @@ def enrich_data_full(df, date_col='business_dt', region_col='region'):
     final_df = df[[c for c in keep_cols if c in df.columns]].copy()
     for c in cat_cols:
         if c in final_df.columns:
-            final_df[c] = final_df[c].astype('category')
+            final_df[c] = as_na_category(final_df[c])
 
     return final_df, cat_cols
 
+def inputs_fingerprint(paths) -> str:
+    """Короткий хэш (blake2b) от пути, mtime и размера входных файлов; отсутствующий файл тоже входит в ключ."""
+    h = hashlib.blake2b(digest_size=8)
+    for p in paths:
+        p = Path(p)
+        st = p.stat() if p.exists() else None
+        h.update(f"{p.resolve()}|{st.st_mtime_ns if st else -1}|{st.st_size if st else -1};".encode('utf-8'))
+    return h.hexdigest()
+
+ENRICH_KEY_META = b'nps_enrich_key'  # ключ входных данных в метаданных parquet-экспорта
+
+def save_enriched_parquet(df: pd.DataFrame, path: Path, enrich_key: str):
+    """Пишет обогащенный датасет в parquet/zstd с ключом inputs_fingerprint в метаданных схемы."""
+    # Оставшиеся object-колонки пишем как category: parquet хранит их словарным кодированием
+    obj_cols = df.columns[df.dtypes == object]
+    table = pa.Table.from_pandas(df.astype({c: 'category' for c in obj_cols}), preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), ENRICH_KEY_META: enrich_key.encode('utf-8')})
+    pq.write_table(table, path, compression='zstd', use_dictionary=True)
+
+def load_enriched_parquet(path: Path, enrich_key: str):
+    """Читает parquet-экспорт, если он построен по тем же входным данным (ключ в метаданных), иначе None."""
+    if not path.exists():
+        return None
+    try:
+        if (pq.read_schema(path).metadata or {}).get(ENRICH_KEY_META) != enrich_key.encode('utf-8'):
+            return None
+        return pd.read_parquet(path)
+    except Exception as e:
+        print(f"[WARN] Не удалось прочитать сохраненный обогащенный датасет {path}: {e}")
+        return None
+
 
 # ============================================================
 # ==== ОБУЧЕНИЕ МОДЕЛИ И КРОСС-ВАЛИДАЦИЯ ====
@@ -1215,18 +1541,12 @@ def train_one_fold_classifier_bin(data, cat_cols, num_cols, weight_col, target_c
               'one_hot_max_size': 5,'max_ctr_complexity': 1,'rsm': 0.8}
     if USED_RAM_LIMIT is not None:
         params['used_ram_limit'] = USED_RAM_LIMIT
+    # data уже подготовлена prepare_model_data: категориальные признаки — pandas Categorical со строковыми
+    # категориями и уровнем 'NA' вместо пропусков, вес числовой, таргет int
     train, test = data.iloc[train_idx], data.iloc[test_idx]
-    X_train = train[cat_cols + num_cols].copy()
-    X_test  = test[cat_cols + num_cols].copy()
-    y_train = train[target_col_bin].astype(int).copy()
-    y_test  = test[target_col_bin].astype(int).copy()
-    w_train = pd.to_numeric(train[weight_col], errors='coerce').fillna(1.0)
-    w_test  = pd.to_numeric(test[weight_col], errors='coerce').fillna(1.0)
-    for col in cat_cols:
-        if col in X_train.columns:
-            X_train[col] = X_train[col].astype(str).fillna('NA')
-        if col in X_test.columns:
-            X_test[col] = X_test[col].astype(str).fillna('NA')
+    X_train, X_test = train[cat_cols + num_cols], test[cat_cols + num_cols]
+    y_train, y_test = train[target_col_bin], test[target_col_bin]
+    w_train, w_test = train[weight_col], test[weight_col]
     cat_features_indices = [i for i, col in enumerate(X_train.columns) if col in cat_cols]
     model = CatBoostClassifier(**params)
     train_pool = Pool(X_train, label=y_train, weight=w_train, cat_features=cat_features_indices)
@@ -1250,14 +1570,20 @@ def train_one_fold_classifier_bin(data, cat_cols, num_cols, weight_col, target_c
     return {'metrics': metrics, 'model': model, 'feature_importance': fi,
             'test_idx': test.index.tolist(), 'X_test': X_test, 'y_test': y_test, 'w_test': w_test, 'proba': proba}
 
+def prepare_model_data(data, cat_cols, num_cols, weight_col, target_col_bin):
+    """Готовит признаки, вес и таргет один раз для всех фолдов CV; категории передаются в Pool как pandas Categorical."""
+    model_data = data[cat_cols + num_cols].copy(deep=False)
+    for c in cat_cols:
+        model_data[c] = as_na_category(data[c])  # для колонок из enrich_data_full — без копирования
+    model_data[weight_col] = pd.to_numeric(data[weight_col], errors='coerce').fillna(1.0)
+    model_data[target_col_bin] = data[target_col_bin].astype(int)
+    return model_data
+
 def timecv_evaluate_classifier_bin(enriched, target_segment_col, weight_col, n_splits=8, cat_cols=None, num_cols=None):
-    enriched = enriched.copy()
-    def to_bin(x):
-        s = str(x).strip().lower()
-        return 1 if s in ('detractor', 'критик') else 0 # Для Промоутеров меняем тут лейблы просто
-    enriched['target_bin'] = enriched[target_segment_col].map(to_bin)
-    enriched.dropna(subset=['day_local', 'target_bin'], inplace=True)
-    enriched['target_bin'] = enriched['target_bin'].astype(int)
+    enriched = enriched.copy(deep=False)
+    seg = enriched[target_segment_col].astype(str).str.strip().str.lower()
+    enriched['target_bin'] = seg.isin(['detractor', 'критик']).astype('int8') # Для Промоутеров меняем тут лейблы просто
+    enriched.dropna(subset=['day_local'], inplace=True)
     enriched.sort_values('day_local', inplace=True, ignore_index=True)
     enriched['time_block'] = pd.to_datetime(enriched['day_local']).dt.to_period('W').astype(str)
 
@@ -1265,21 +1591,24 @@ def timecv_evaluate_classifier_bin(enriched, target_segment_col, weight_col, n_s
     print(f"   [INFO] Количество уникальных временных блоков (недель) для группировки: {enriched['time_block'].nunique()}")
 
     cv = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=RANDOM_SEED)
-    X = enriched.drop(columns=['target_bin'])
+    # sklearn берет из X только число строк, поэтому вместо копии признаков передается пустой массив;
+    # фолды генерируются лениво внутри цикла обучения
+    dummy_X = np.empty((len(enriched), 0))
     y_stratify = enriched['target_bin']
     groups = enriched['time_block']
-    folds_indices = list(cv.split(X, y_stratify, groups))
 
-    print(f"   [INFO] Сгенерировано {len(folds_indices)} фолдов для CV с помощью StratifiedGroupKFold.")
+    print(f"   [INFO] Сгенерировано {cv.get_n_splits()} фолдов для CV с помощью StratifiedGroupKFold.")
 
     if cat_cols is None or num_cols is None:
         cat_cols, num_cols = build_feature_lists_all(enriched)
 
+    model_data = prepare_model_data(enriched, cat_cols, num_cols, weight_col, 'target_bin')
     folds_results = []
-    for i, (train_idx, test_idx) in enumerate(tqdm(folds_indices, desc="Обучение на фолдах (BIN)")):
+    folds = cv.split(dummy_X, y_stratify, groups)
+    for i, (train_idx, test_idx) in enumerate(tqdm(folds, total=n_splits, desc="Обучение на фолдах (BIN)")):
         test_dates = enriched.iloc[test_idx]['day_local']
         print(f"  Фолд {i+1}/{n_splits}. Тестовый период: {test_dates.min().date()} - {test_dates.max().date()}")
-        fold_result = train_one_fold_classifier_bin(enriched, cat_cols, num_cols, weight_col, 'target_bin', train_idx, test_idx)
+        fold_result = train_one_fold_classifier_bin(model_data, cat_cols, num_cols, weight_col, 'target_bin', train_idx, test_idx)
         fold_result['test_start'], fold_result['test_end'] = test_dates.min(), test_dates.max()
         folds_results.append(fold_result)
         gc.collect()
@@ -1295,7 +1624,7 @@ def timecv_evaluate_classifier_bin(enriched, target_segment_col, weight_col, n_s
     fi_agg = pd.concat([fi[['feature','share']] for fi in all_fi], ignore_index=True).groupby('feature')['share'].mean().sort_values(ascending=False).reset_index()
 
     last_fold_model = folds_results[-1]['model']
-    joblib.dump(last_fold_model, MODEL_SAVE_PATH)
+    last_fold_model.save_model(str(MODEL_SAVE_PATH), format='cbm')
     print(f"   [INFO] Модель последнего фолда сохранена в: {MODEL_SAVE_PATH}")
 
     return {'cv_table': cv_table, 'fi_agg': fi_agg, 'last_X_test': folds_results[-1]['X_test']}
@@ -1307,31 +1636,54 @@ def timecv_evaluate_classifier_bin(enriched, target_segment_col, weight_col, n_s
 if __name__ == "__main__":
     np.random.seed(RANDOM_SEED)
 
-    # --- 1. Загрузка данных ---
-    print(f"1. Загрузка исходных данных из '{SOURCE_DATA_PATH}'...")
-    try:
-        df = pd.read_csv(SOURCE_DATA_PATH, sep=',')
-        print(f"   Успешно загружено. Размер: {df.shape}")
-    except FileNotFoundError:
-        print(f"   КРИТИЧЕСКАЯ ОШИБКА: Файл не найден. Проверьте путь в SOURCE_DATA_PATH.")
-        print(f"   Ожидаемый путь: {SOURCE_DATA_PATH.resolve()}")
-        raise SystemExit(1)
-
-    # --- 2. Обогащение данных ---
-    print("\n2. Запуск процесса обогащения данных (Календарь, Астро, Погода, Новости)...")
-    enriched_df, cat_cols = enrich_data_full(df, date_col='business_dt', region_col='region')
-    del df; gc.collect()
+    # Ключ входных данных: исходные данные, события, Kp/Ap и сам скрипт (изменение кода сбрасывает кэш).
+    # Parquet-экспорт с тем же ключом в метаданных переиспользуется вместо повторного обогащения
+    enrich_key = inputs_fingerprint([SOURCE_DATA_PATH, EVENTS_TSV_PATH, KP_INDEX_PATH, AP_INDEX_PATH, Path(__file__)])
+    save_as_parquet = not ENRICHED_SAVE_CSV and ENRICHED_DATA_SAVE_PATH.suffix == '.parquet'
+    enriched_df = None
+    if save_as_parquet and SOURCE_DATA_PATH.exists():
+        enriched_df = load_enriched_parquet(ENRICHED_DATA_SAVE_PATH, enrich_key)
+    enriched_from_cache = enriched_df is not None
+    if enriched_from_cache:
+        cat_cols, _ = build_feature_lists_all(enriched_df)
+        print(f"1-2. Входные данные не менялись: обогащенный датасет загружен из '{ENRICHED_DATA_SAVE_PATH}'. Размер: {enriched_df.shape}")
+
+    if enriched_df is None:
+        # --- 1. Загрузка данных ---
+        print(f"1. Загрузка исходных данных из '{SOURCE_DATA_PATH}'...")
+        try:
+            # Многопоточный колоночный парсер pyarrow; категориальные колонки создаются сразу при чтении
+            df = pd.read_csv(SOURCE_DATA_PATH, sep=',', engine='pyarrow', dtype=SOURCE_CSV_DTYPES)
+            print(f"   Успешно загружено. Размер: {df.shape}")
+        except FileNotFoundError:
+            print(f"   КРИТИЧЕСКАЯ ОШИБКА: Файл не найден. Проверьте путь в SOURCE_DATA_PATH.")
+            print(f"   Ожидаемый путь: {SOURCE_DATA_PATH.resolve()}")
+            raise SystemExit(1)
+
+        # --- 2. Обогащение данных ---
+        print("\n2. Запуск процесса обогащения данных (Календарь, Астро, Погода, Новости)...")
+        enriched_df, cat_cols = enrich_data_full(df, date_col='business_dt', region_col='region')
+        del df; gc.collect()
 
     # --- 3. Отчет по пропускам и сохранение ---
     print("\n3. Отчет по долям пропусков в итоговых признаках:")
-    nan_report = enriched_df[cat_cols].isna().mean().mul(100).sort_values(ascending=False).to_frame('NaN_pct')
+    # Пропуски в категориальных признаках хранятся как категория 'NA'
+    nan_report = (enriched_df[cat_cols].isna() | enriched_df[cat_cols].eq('NA')).mean().mul(100).sort_values(ascending=False).to_frame('NaN_pct')
     nan_report['group'] = nan_report.index.to_series().map(get_feature_group)
     print(nan_report[nan_report['NaN_pct'] > 0].round(2))
 
     try:
-        print(f"\n4. Сохранение обогащенного датасета в '{ENRICHED_DATA_SAVE_PATH}'...")
-        enriched_df.to_csv(ENRICHED_DATA_SAVE_PATH, index=False, encoding='utf-8', compression='gzip')
-        print("   Успешно сохранено.")
+        if enriched_from_cache:
+            print(f"\n4. Обогащенный датасет уже сохранен в '{ENRICHED_DATA_SAVE_PATH}'.")
+        elif save_as_parquet:
+            print(f"\n4. Сохранение обогащенного датасета в '{ENRICHED_DATA_SAVE_PATH}'...")
+            save_enriched_parquet(enriched_df, ENRICHED_DATA_SAVE_PATH, enrich_key)
+            print("   Успешно сохранено.")
+        else:
+            save_path = ENRICHED_DATA_SAVE_PATH.with_suffix('.csv.gz') if ENRICHED_DATA_SAVE_PATH.suffix == '.parquet' else ENRICHED_DATA_SAVE_PATH
+            print(f"\n4. Сохранение обогащенного датасета в '{save_path}'...")
+            enriched_df.to_csv(save_path, index=False, encoding='utf-8', compression='gzip')
+            print("   Успешно сохранено.")
     except Exception as e:
         print(f"\n[WARN] Не удалось сохранить обогащенный датасет: {e}")
 
@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from catboost import Pool
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import main  # noqa: E402
+
+
+def test_float_categorical_with_nan_goes_to_pool():
+    data = pd.DataFrame({
+        'cx_flag': pd.Series([1.0, np.nan, 0.0, 1.0], dtype='category'),
+        'ww_weight': [1.0, 'x', 2.0, 1.0],
+        'target_bin': [1, 0, 0, 1],
+    })
+    model_data = main.prepare_model_data(data, ['cx_flag'], [], 'ww_weight', 'target_bin')
+
+    col = model_data['cx_flag']
+    assert col.dtype.name == 'category'
+    assert all(isinstance(c, str) for c in col.cat.categories)
+    assert col.tolist() == ['1.0', 'NA', '0.0', '1.0']
+    assert model_data['ww_weight'].tolist() == [1.0, 1.0, 2.0, 1.0]
+
+    pool = Pool(model_data[['cx_flag']], label=model_data['target_bin'], cat_features=[0])
+    assert pool.num_row() == 4
+
+
+def test_string_categorical_keeps_existing_na_level():
+    s = pd.Categorical(['NA', 'зима', None], categories=['NA', 'зима'])
+    out = main.as_na_category(pd.Series(s))
+    assert list(out.cat.categories) == ['NA', 'зима']
+    assert out.tolist() == ['NA', 'зима', 'NA']